@@ -0,0 +1 @@
+"""Synthetic data and a repeatable benchmark suite for the backend."""
@@ -0,0 +1,213 @@
+"""Repeatable benchmarks of the main API operations.
+
+    python -m benchmarks.run --rows 1000000 --repeat 3 --json results.json
+
+Writes a synthetic dataset (see ``benchmarks.synthetic``), then runs the app
+in-process against a temporary data directory and times upload, formula
+compilation, cold and cached calculation, batch calculation, filtering,
+result paging, reports and export. Each benchmark reports the median time
+over ``--repeat`` runs, throughput, the peak resident memory of the process
+while it ran and the per-stage breakdown from the ``Server-Timing`` header.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import add_config_arguments, config_from_args, write_csv
+
+FORMULAS = [
+    ("Net Price", "Total Sales * (1 - (Discount Percentage / 100))"),
+    ("Net of Deductions", "Sale Price - Discount Amount - Chargeback Amount - Rebate Amount - Admin Fees"),
+    ("Net per Unit", "(Sale Price - Discount Amount - Chargeback Amount) / Units Sold"),
+    ("Capped Net", "min(Total Sales - Rebate Amount - Volume Tier Discount, Regulatory Price Limit)"),
+]
+
+
+def server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Stage durations in milliseconds from a ``Server-Timing`` header."""
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def _resident_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemorySampler:
+    """Peak resident memory of the process while a block runs, sampled from /proc (Linux only).
+
+    Sampling is used rather than tracemalloc, which slows parsing and
+    numpy-heavy code down by an order of magnitude.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _resident_bytes())
+
+    def __enter__(self) -> "MemorySampler":
+        self.peak = _resident_bytes()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.peak is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _resident_bytes())
+
+
+def measure(name: str, run: Callable[[int], object], items: int, unit: str = "rows", repeat: int = 3) -> Dict:
+    """Time ``run(i)`` for each repeat ``i``; it returns an HTTP response or None."""
+    times, peaks, stages = [], [], []
+    for i in range(repeat):
+        with MemorySampler() as memory:
+            start = time.perf_counter()
+            response = run(i)
+            elapsed = time.perf_counter() - start
+        peaks.append(memory.peak)
+        if response is not None:
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: HTTP {response.status_code}: {response.text[:200]}")
+            stages.append(server_timing(response.headers.get("Server-Timing")))
+        times.append(elapsed)
+    median = statistics.median(times)
+    result = {
+        "name": name,
+        "seconds": round(median, 4),
+        "min_seconds": round(min(times), 4),
+        f"{unit}_per_second": round(items / median, 1) if median else None,
+        "peak_rss_mb": round(max(peaks) / 2 ** 20, 1) if None not in peaks else None,
+    }
+    if stages:
+        # Stage timings of the median run
+        result["stages_ms"] = stages[times.index(sorted(times)[len(times) // 2])]
+    print(f"{name:<24}{median:>10.4f}s  {result[f'{unit}_per_second'] or 0:>14,.0f} {unit}/s"
+          f"  {result['peak_rss_mb'] or 0:>9.1f} MB peak", file=sys.stderr)
+    return result
+
+
+def run_benchmarks(csv_path: str, rows: int, repeat: int) -> List[Dict]:
+    from fastapi.testclient import TestClient
+
+    from formula_engine import compile_formula
+    from main import app
+
+    results = []
+    with TestClient(app) as client:
+        dataset_id = None
+
+        def upload(i):
+            nonlocal dataset_id
+            with open(csv_path, "rb") as f:
+                response = client.post("/api/upload", params={"include_data": "false"},
+                                       files={"file": ("synthetic.csv", f, "text/csv")})
+            dataset_id = response.json().get("dataset_id")
+            return response
+        results.append(measure("upload", upload, rows, repeat=repeat))
+
+        compiles = 1000
+        def compile_all(i):
+            for _ in range(compiles // len(FORMULAS)):
+                for _, formula in FORMULAS:
+                    compile_formula(formula)
+        results.append(measure("compile formulas", compile_all, compiles, unit="formulas", repeat=repeat))
+
+        def create_formula(name, formula_string):
+            response = client.post("/api/formulas", json={"name": name, "description": "benchmark",
+                                                          "formula_string": formula_string})
+            response.raise_for_status()
+            return response.json()["id"]
+
+        # A different constant per repeat, so each cold run misses the result cache
+        cold_ids = [create_formula(f"Cold {i}", f"{FORMULAS[0][1]} + {i}") for i in range(repeat)]
+        calculation = {"dataset_id": dataset_id, "include_results": False}
+        results.append(measure("calculate (cold)", lambda i: client.post(
+            "/api/calculate", json={**calculation, "formula_id": cold_ids[i]}), rows, repeat=repeat))
+        results.append(measure("calculate (cached)", lambda i: client.post(
+            "/api/calculate", json={**calculation, "formula_id": cold_ids[0]}), rows, repeat=repeat))
+
+        results.append(measure("calculate (filtered)", lambda i: client.post(
+            "/api/calculate", json={**calculation, "formula_id": cold_ids[i],
+                                    "filters": {"transaction_type": "North"}}), rows, repeat=repeat))
+
+        # A fresh set of formulas per repeat, evaluated together
+        batches = [[create_formula(f"{name} {i}", f"{formula} + {i}") for name, formula in FORMULAS]
+                   for i in range(repeat)]
+        results.append(measure("calculate batch", lambda i: client.post(
+            "/api/calculate/batch", json={"formula_ids": batches[i], "dataset_id": dataset_id,
+                                          "include_results": False}),
+            rows * len(FORMULAS), repeat=repeat))
+
+        page = {"dataset_id": dataset_id, "limit": 100}
+        results.append(measure("filter + sort rows", lambda i: client.get(
+            "/api/data", params={**page, "product": "Drug 1", "sort_by": "Price", "sort_order": "desc"}),
+            rows, repeat=repeat))
+        results.append(measure("page rows (columns)", lambda i: client.get(
+            "/api/data", params={**page, "limit": 10_000, "offset": 10_000 * i, "layout": "columns"}),
+            min(rows, 10_000), repeat=repeat))
+
+        calculation_id = client.post("/api/calculate", json={**calculation, "formula_id": cold_ids[0]}).json()[
+            "calculation_id"]
+        results.append(measure("filter results", lambda i: client.get(
+            f"/api/calculations/{calculation_id}/results",
+            params={"compliance_status": "Non-Compliant", "customer": "Hospital", "limit": 100}),
+            rows, repeat=repeat))
+        results.append(measure("report", lambda i: client.get(
+            "/api/reports", params={"calculation_id": calculation_id, "group_by": "product,date"}),
+            rows, repeat=repeat))
+        results.append(measure("export csv", lambda i: client.get(
+            f"/api/calculations/{calculation_id}/export", params={"format": "csv"}), rows, repeat=1))
+        results.append(measure("export arrow", lambda i: client.get(
+            f"/api/calculations/{calculation_id}/export", params={"format": "arrow"}), rows, repeat=1))
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the API on a synthetic dataset")
+    add_config_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark; the median is reported")
+    parser.add_argument("--json", help="write the results to this file rather than standard output")
+    args = parser.parse_args(argv)
+    config = config_from_args(args)
+
+    with tempfile.TemporaryDirectory(prefix="formula-builder-bench-") as directory:
+        # Must be set before the app is imported
+        os.environ["FORMULA_BUILDER_DATA_DIR"] = os.path.join(directory, "data")
+        csv_path = os.path.join(directory, "synthetic.csv")
+        start = time.perf_counter()
+        size = write_csv(csv_path, config)
+        print(f"Generated {config.rows:,} rows ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+        results = run_benchmarks(csv_path, config.rows, args.repeat)
+
+    report = {"config": vars(config), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Synthetic sales data with the upload schema.
+
+Rows are generated ``chunk_rows`` at a time from a seeded generator, so the
+same arguments always produce the same file and datasets of up to tens of
+millions of rows can be written without holding them in memory. Category
+cardinalities and the rate of missing values are configurable:
+
+    python -m benchmarks.synthetic --rows 1000000 --products 200 --missing-rate 0.05 --out sales.csv
+"""
+import argparse
+from dataclasses import dataclass
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from schema import COLUMN_MAPPING, MINIMUM_REQUIRED_COLUMNS
+
+MAX_ROWS = 10_000_000
+
+REGIONS = ["North", "South", "East", "West", "Central", "Northeast", "Southeast", "Northwest", "Southwest"]
+CUSTOMER_CATEGORIES = ["Government", "Retail", "Hospital", "Wholesale", "Clinic", "Pharmacy", "Mail Order"]
+COMPLIANCE_STATUSES = ["Compliant", "Non-Compliant", "Under Review"]
+MARKET_SEGMENTS = ["Brand", "Generic", "Specialty", "Biosimilar", "OTC"]
+
+
+@dataclass
+class SyntheticConfig:
+    rows: int = 100_000
+    products: int = 100
+    manufacturers: int = 20
+    customers: int = len(CUSTOMER_CATEGORIES)
+    regions: int = len(REGIONS)
+    years: int = 5
+    missing_rate: float = 0.02  # Share of blank values in each optional column
+    seed: int = 0
+    chunk_rows: int = 250_000
+
+    def __post_init__(self):
+        if not 0 < self.rows <= MAX_ROWS:
+            raise ValueError(f"rows must be between 1 and {MAX_ROWS}")
+        if not 0 <= self.missing_rate < 1:
+            raise ValueError("missing_rate must be in [0, 1)")
+        for name in ("products", "manufacturers", "customers", "regions", "years", "chunk_rows"):
+            if getattr(self, name) < 1:
+                raise ValueError(f"{name} must be at least 1")
+
+
+def _labels(prefix: str, names, count: int) -> np.ndarray:
+    """``count`` category labels, the well-known ``names`` first."""
+    labels = list(names[:count]) + [f"{prefix} {i}" for i in range(len(names), count)]
+    return np.array(labels, dtype=object)
+
+
+def _chunk(rng: np.random.Generator, config: SyntheticConfig, start: int, rows: int) -> pd.DataFrame:
+    products = _labels("Drug", [], config.products)
+    manufacturers = _labels("Manufacturer", [], config.manufacturers)
+    customers = _labels("Customer", CUSTOMER_CATEGORIES, config.customers)
+    regions = _labels("Region", REGIONS, config.regions)
+
+    # Products are skewed, as in real sales data; each product has one manufacturer
+    product = np.minimum(rng.zipf(1.3, rows) - 1, config.products - 1)
+    sale_price = np.round(rng.lognormal(4.5, 0.8, rows), 2)
+    units = rng.integers(1, 500, rows)
+    total_sales = np.round(sale_price * units, 2)
+    discount_percentage = np.round(rng.uniform(0, 35, rows), 1)
+    discount_amount = np.round(total_sales * discount_percentage / 100, 2)
+    free_goods = rng.poisson(0.5, rows)
+
+    frame = pd.DataFrame({
+        "Transaction ID": "T" + pd.RangeIndex(start, start + rows).astype(str),
+        "Drug Name": products[product],
+        "Sale Price (USD)": sale_price,
+        "Discount Amount (USD)": discount_amount,
+        "Chargeback Amount (USD)": np.round(total_sales * rng.uniform(0, 0.1, rows), 2),
+        "Rebate Amount (USD)": np.round(total_sales * rng.uniform(0, 0.15, rows), 2),
+        "Admin Fees (USD)": np.round(total_sales * rng.uniform(0, 0.03, rows), 2),
+        "Free Goods Adjustments": np.round(free_goods * sale_price, 2),
+        "Units Sold": units,
+        "Exclusion Flag": np.where(rng.random(rows) < 0.05, "Yes", "No"),
+        "Manufacturer": manufacturers[product % config.manufacturers],
+        "Sales Year": 2025 - config.years + 1 + rng.integers(0, config.years, rows),
+        "Total Sales (USD)": total_sales,
+        "Discount Percentage (%)": discount_percentage,
+        "Customer Category": customers[rng.integers(0, config.customers, rows)],
+        "Sales Region": regions[rng.integers(0, config.regions, rows)],
+        "Regulatory Price Limit (USD)": np.round(total_sales * rng.uniform(0.6, 1.1, rows), 2),
+        "Pricing Compliance Status": rng.choice(COMPLIANCE_STATUSES, rows, p=[0.8, 0.15, 0.05]),
+        "Number of Free Goods": free_goods,
+        "Volume Tier Discount (USD)": np.round(total_sales * np.where(units > 250, 0.05, 0.0), 2),
+        "Competitor Price (USD)": np.round(sale_price * rng.uniform(0.8, 1.2, rows), 2),
+        "Profit Margin (%)": np.round(rng.normal(25, 10, rows), 1),
+        "Market Segment": rng.choice(MARKET_SEGMENTS, rows),
+    }, columns=list(COLUMN_MAPPING))
+
+    if config.missing_rate:
+        for name in frame.columns:
+            if name in MINIMUM_REQUIRED_COLUMNS or name == "Transaction ID":
+                continue
+            blank = rng.random(rows) < config.missing_rate
+            if blank.any():
+                # Nullable integers, so whole numbers are not written as floats
+                values = frame[name].astype("Int64") if frame[name].dtype.kind == "i" else frame[name]
+                frame[name] = values.mask(blank)
+    return frame
+
+
+def generate(config: SyntheticConfig) -> Iterator[pd.DataFrame]:
+    """The rows of a synthetic dataset, in frames of at most ``config.chunk_rows`` rows."""
+    rng = np.random.default_rng(config.seed)
+    for start in range(0, config.rows, config.chunk_rows):
+        yield _chunk(rng, config, start, min(config.chunk_rows, config.rows - start))
+
+
+def write_csv(path: str, config: SyntheticConfig) -> int:
+    """Write a synthetic dataset to ``path`` as CSV and return its size in bytes."""
+    # Arrow's CSV writer is several times faster than DataFrame.to_csv
+    import pyarrow as pa
+    import pyarrow.csv
+
+    with open(path, "wb") as f:
+        writer = schema = None
+        for frame in generate(config):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                schema = table.schema.remove_metadata()
+                writer = pyarrow.csv.CSVWriter(f, schema)
+            writer.write_table(table.cast(schema))
+        writer.close()
+        return f.tell()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Write a synthetic sales dataset with the upload schema")
+    parser.add_argument("--out", required=True, help="CSV file to write")
+    add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = SyntheticConfig()
+    parser.add_argument("--rows", type=int, default=defaults.rows, help=f"number of rows, at most {MAX_ROWS}")
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--manufacturers", type=int, default=defaults.manufacturers)
+    parser.add_argument("--customers", type=int, default=defaults.customers)
+    parser.add_argument("--regions", type=int, default=defaults.regions)
+    parser.add_argument("--years", type=int, default=defaults.years)
+    parser.add_argument("--missing-rate", type=float, default=defaults.missing_rate,
+                        help="share of blank values in each optional column")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> SyntheticConfig:
+    return SyntheticConfig(rows=args.rows, products=args.products, manufacturers=args.manufacturers,
+                           customers=args.customers, regions=args.regions, years=args.years,
+                           missing_rate=args.missing_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    size = write_csv(args.out, config_from_args(args))
+    print(f"Wrote {args.rows} rows ({size / 1e6:.1f} MB) to {args.out}")
@@ -0,0 +1,833 @@
+"""Columnar on-disk storage for uploaded datasets.
+
+Each dataset lives in its own directory under ``DATA_DIR``:
+
+    <dataset_id>/meta.json             row counts, versions, column types
+    <dataset_id>/<column>.bin                raw little-endian column values
+    <dataset_id>/<column>.dict.json          dictionary for categorical text columns
+    <dataset_id>/<column>.bytes              UTF-8 text of string columns
+    <dataset_id>/<column>.i<v>.postings.bin  row ids grouped by code (indexed columns)
+    <dataset_id>/<column>.i<v>.offsets.bin   where each code's row ids start
+
+Numeric columns are stored as float64/int64 arrays (NaN marks a missing
+percentage), and categorical text columns such as Product, Customer,
+Manufacturer and Transaction Type are dictionary-encoded as int32 codes with
+-1 for missing. High-cardinality text (``schema.STRING_COLUMNS``, e.g.
+Transaction ID) would need a dictionary entry per row, so it is stored as
+UTF-8 bytes plus the int64 offset where each row's text ends; a missing
+value takes no bytes and stores the bitwise complement of its end offset.
+Files are appended to as data arrives and reopened with ``np.memmap``, so
+only the columns a request touches are paged into memory.
+
+Datasets only ever grow: a version is the first ``num_rows`` rows of the
+column files, and text dictionaries are append-only so existing codes stay
+valid when more rows are written. Correcting values of existing rows copies
+the column to a revision file (``<column>.v<version>.bin``) so that older
+versions keep their values; each version records which rows it corrected.
+A column first written by a later version, by an append or a correction,
+records that version as ``added`` and is absent from older versions.
+Indexes on the columns users filter by (``schema.INDEXED_COLUMNS``) are
+rebuilt whenever a version appends to or corrects them, into new files so
+that readers of older versions are never affected.
+
+``DatasetStore`` keeps recently used ``Dataset`` objects open, so their
+dictionaries and indexes are loaded once rather than on every request.
+"""
+import copy
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from query import ColumnIndex, category_ranks
+from schema import (ALL_COLUMNS, FLOAT_COLUMNS, INDEXED_COLUMNS, INT_COLUMNS, MISSING_VALUE, PERCENT_COLUMNS,
+                    STRING_COLUMNS)
+
+DATA_DIR = os.environ.get(
+    "FORMULA_BUILDER_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+
+META_FILE = "meta.json"
+ROW_HASHES_FILE = "row_hashes.bin"
+
+# Dataset versions kept open by DatasetStore, with their dictionaries and indexes
+OPEN_DATASETS = 16
+
+
+class DatasetBusyError(RuntimeError):
+    """Raised when a dataset is opened for writing while another writer is open."""
+
+
+def column_kind(name: str) -> str:
+    if name in FLOAT_COLUMNS:
+        return "float"
+    if name in INT_COLUMNS:
+        return "int"
+    if name in PERCENT_COLUMNS:
+        return "percent"
+    if name in STRING_COLUMNS:
+        return "string"
+    return "category"
+
+
+_KIND_DTYPES = {
+    "float": np.dtype("<f8"),
+    "int": np.dtype("<i8"),
+    "percent": np.dtype("<f8"),
+    "category": np.dtype("<i4"),
+    "string": np.dtype("<i8"),  # end offsets into the .bytes file
+}
+
+_KIND_DEFAULTS = {
+    "float": 0.0,
+    "int": 0,
+    "percent": np.nan,
+    "category": -1,
+    "string": -1,  # missing, with no text before it
+}
+
+TEXT_KINDS = ("category", "string")
+
+
+def normalize_frame(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Apply the upload coercion rules to a renamed frame, one column at a time.
+
+    Float columns default to 0.0 and int columns to 0 when missing or not
+    numeric; percentage columns keep NaN (shown as "--"); everything else is
+    converted to text with None for missing values.
+    """
+    columns = {}
+    for name in df.columns:
+        if name not in ALL_COLUMNS:
+            continue
+        series = df[name]
+        kind = column_kind(name)
+        if kind == "float":
+            columns[name] = pd.to_numeric(series, errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+        elif kind == "int":
+            columns[name] = pd.to_numeric(series, errors="coerce").fillna(0).to_numpy(dtype=np.float64).astype(np.int64)
+        elif kind == "percent":
+            columns[name] = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            present = series.notna()
+            text = series.astype(object).where(present, None)
+            text[present] = series[present].astype(str)
+            columns[name] = text.to_numpy(dtype=object)
+    return columns
+
+
+def _column_file(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def _latest_file(info: Dict) -> str:
+    """File stem holding the newest values of a column."""
+    revisions = info.get("revisions")
+    return revisions[-1]["file"] if revisions else info["file"]
+
+
+def _encode_strings(values: np.ndarray, end: int) -> Tuple[np.ndarray, bytes]:
+    """End offsets and UTF-8 bytes of text values written after byte ``end``."""
+    present = pd.notna(values)
+    encoded = [value.encode() for value in values[present]]
+    lengths = np.zeros(len(values), dtype=np.int64)
+    lengths[present] = [len(value) for value in encoded]
+    ends = end + np.cumsum(lengths)
+    ends[~present] = ~ends[~present]
+    return ends, b"".join(encoded)
+
+
+def _string_end(ends: np.ndarray) -> int:
+    """Bytes of text taken by the rows whose end offsets are ``ends``."""
+    if not len(ends):
+        return 0
+    end = int(ends[-1])
+    return end if end >= 0 else ~end
+
+
+def _starts(ends: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    previous = np.asarray(ends[np.maximum(positions - 1, 0)], dtype=np.int64)
+    starts = np.where(previous < 0, ~previous, previous)
+    starts[positions == 0] = 0
+    return starts
+
+
+def _decode_strings(ends: np.ndarray, data: np.ndarray, row_ids=None) -> np.ndarray:
+    positions = np.arange(len(ends)) if row_ids is None else np.asarray(row_ids, dtype=np.int64)
+    stops = np.asarray(ends[positions], dtype=np.int64)
+    starts = _starts(ends, positions)
+    present = stops >= 0
+    buffer = memoryview(data)
+    values = np.full(len(positions), None, dtype=object)
+    values[present] = [str(buffer[start:stop], "utf-8")
+                       for start, stop in zip(starts[present].tolist(), stops[present].tolist())]
+    return values
+
+
+def _find_string(ends: np.ndarray, data: np.ndarray, value: str) -> np.ndarray:
+    """Rows whose text equals ``value``, compared a byte at a time over candidate rows."""
+    needle = np.frombuffer(value.encode(), dtype=np.uint8)
+    stops = np.asarray(ends, dtype=np.int64)
+    starts = _starts(stops, np.arange(len(stops)))
+    rows = np.flatnonzero((stops >= 0) & (stops - starts == len(needle)))
+    for k, byte in enumerate(needle):
+        rows = rows[data[starts[rows] + k] == byte]
+    return rows
+
+
+def _write_json(path: str, content) -> None:
+    # Write to a temporary file first so a crash never leaves half a file behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
+
+
+class Table(ABC):
+    """Typed column arrays with categorical text dictionary-encoded.
+
+    Subclasses provide ``raw`` (stored values, codes for categorical text
+    and end offsets for string columns), ``categories`` and ``string_data``.
+    """
+
+    num_rows = 0
+    columns: List[str] = []
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def has_column(self, name: str) -> bool:
+        return name in self.columns
+
+    def kind(self, name: str) -> str:
+        return column_kind(name)
+
+    @abstractmethod
+    def raw(self, name: str) -> np.ndarray:
+        """Stored values of a column (dictionary codes for categorical text)."""
+
+    @abstractmethod
+    def categories(self, name: str) -> np.ndarray:
+        """Dictionary of a categorical text column, with None appended so code -1 decodes to None."""
+
+    @abstractmethod
+    def string_data(self, name: str) -> np.ndarray:
+        """UTF-8 bytes of a string column, as uint8."""
+
+    def column(self, name: str, row_ids=None) -> np.ndarray:
+        """Values of a column, optionally restricted to ``row_ids``.
+
+        Numeric columns are returned as stored (NaN marks a missing
+        percentage) and text columns are decoded to an object array.
+        Columns that were not uploaded come back as their missing value.
+        """
+        kind = self.kind(name)
+        if not self.has_column(name):
+            length = self.num_rows if row_ids is None else len(row_ids)
+            if kind in TEXT_KINDS:
+                return np.full(length, None, dtype=object)
+            return np.full(length, _KIND_DEFAULTS[kind], dtype=_KIND_DTYPES[kind])
+        if kind == "string":
+            return _decode_strings(self.raw(name), self.string_data(name), row_ids)
+        values = self.raw(name)
+        if row_ids is not None:
+            values = values[row_ids]
+        if kind == "category":
+            return self.categories(name)[values]
+        return values
+
+    def find(self, name: str, value: str) -> np.ndarray:
+        """Row ids where text column ``name`` equals ``value``."""
+        if not self.has_column(name):
+            return np.empty(0, dtype=np.int64)
+        if self.kind(name) == "string":
+            return _find_string(self.raw(name), self.string_data(name), value)
+        codes = np.flatnonzero(self.categories(name)[:-1] == value)
+        return np.flatnonzero(np.isin(self.raw(name), codes))
+
+    def index(self, name: str) -> Optional[ColumnIndex]:
+        """Postings index of a categorical text column, built on first use."""
+        if not self.has_column(name) or self.kind(name) != "category":
+            return None
+        if name not in self._indexes:
+            self._indexes[name] = ColumnIndex.build(self.raw(name), self.categories(name)[:-1])
+        return self._indexes[name]
+
+    def sort_key(self, name: str, row_ids: np.ndarray) -> Optional[np.ndarray]:
+        """Numeric keys that order ``row_ids`` by a column, NaN for missing values."""
+        if name not in ALL_COLUMNS:
+            return None
+        if self.kind(name) == "string":
+            values = pd.Series(self.column(name, row_ids), dtype=object)
+            return values.rank(method="dense", na_option="keep").to_numpy(dtype=np.float64)
+        if self.kind(name) == "category":
+            if not self.has_column(name):
+                return np.zeros(len(row_ids), dtype=np.float64)
+            ranks = category_ranks(self.categories(name)[:-1]).astype(np.float64)
+            ranks[-1] = np.nan
+            return ranks[self.raw(name)[row_ids]]
+        return np.asarray(self.column(name, row_ids), dtype=np.float64)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes of column data held in memory rather than memory-mapped."""
+        return 0
+
+    def to_frame(self, row_ids=None) -> pd.DataFrame:
+        """Typed columns of the rows, for exports; missing percentages are NaN."""
+        length = self.num_rows if row_ids is None else len(row_ids)
+        data = {name: self.column(name, row_ids) if self.has_column(name) else None for name in ALL_COLUMNS}
+        return pd.DataFrame(data, index=pd.RangeIndex(length))
+
+    def _display_frame(self, row_ids=None) -> pd.DataFrame:
+        frame = self.to_frame(row_ids)
+        for name in ALL_COLUMNS:
+            if self.has_column(name) and self.kind(name) == "percent":
+                frame[name] = frame[name].astype(object).where(frame[name].notna(), MISSING_VALUE)
+        return frame
+
+    def to_rows(self, row_ids=None) -> List[Dict]:
+        """Rows in the format returned by the upload and data endpoints."""
+        return self._display_frame(row_ids).to_dict("records")
+
+    def to_columns(self, row_ids=None) -> Dict[str, list]:
+        """The same values as ``to_rows``, one list per column."""
+        frame = self._display_frame(row_ids)
+        return {name: frame[name].tolist() for name in frame.columns}
+
+
+def _index_bytes(indexes: Dict[str, ColumnIndex]) -> int:
+    """Memory held by indexes built on first use."""
+    return sum(index.postings.nbytes + index.offsets.nbytes for index in indexes.values())
+
+
+class InMemoryTable(Table):
+    """A table built from rows posted to the API rather than a stored upload."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], length: int):
+        self.num_rows = length
+        self.columns = [name for name in ALL_COLUMNS if name in columns]
+        self._arrays = {}
+        self._categories = {}
+        self._strings = {}
+        self._indexes = {}
+        for name in self.columns:
+            if column_kind(name) == "category":
+                codes, uniques = pd.factorize(columns[name], use_na_sentinel=True)
+                self._arrays[name] = codes.astype(np.int32)
+                self._categories[name] = np.array(list(uniques) + [None], dtype=object)
+            elif column_kind(name) == "string":
+                self._arrays[name], data = _encode_strings(np.asarray(columns[name], dtype=object), 0)
+                self._strings[name] = np.frombuffer(data, dtype=np.uint8)
+            else:
+                self._arrays[name] = np.asarray(columns[name], dtype=_KIND_DTYPES[column_kind(name)])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "InMemoryTable":
+        return cls(normalize_frame(df), len(df))
+
+    def raw(self, name: str) -> np.ndarray:
+        return self._arrays[name]
+
+    def categories(self, name: str) -> np.ndarray:
+        return self._categories[name]
+
+    def string_data(self, name: str) -> np.ndarray:
+        return self._strings[name]
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(values.nbytes for values in self._arrays.values()) + sum(
+            data.nbytes for data in self._strings.values()) + _index_bytes(self._indexes)
+
+
+class TableView(Table):
+    """The rows ``row_ids`` of another table, e.g. the rows matching a filter."""
+
+    def __init__(self, table: Table, row_ids: np.ndarray):
+        if isinstance(table, TableView):
+            # View the underlying table directly rather than stacking views
+            table, row_ids = table.table, table.row_ids[row_ids]
+        self.table = table
+        self.row_ids = row_ids
+        self.num_rows = len(row_ids)
+        self.columns = table.columns
+        self._indexes = {}
+
+    def kind(self, name: str) -> str:
+        return self.table.kind(name)
+
+    def raw(self, name: str) -> np.ndarray:
+        # Gathered on every call; copies kept here would grow results after the cache has sized them
+        return np.asarray(self.table.raw(name)[self.row_ids])
+
+    def categories(self, name: str) -> np.ndarray:
+        return self.table.categories(name)
+
+    def string_data(self, name: str) -> np.ndarray:
+        return self.table.string_data(name)
+
+    def column(self, name: str, row_ids=None) -> np.ndarray:
+        # Only gather the rows asked for; string offsets also only make sense against the underlying rows
+        return self.table.column(name, self.row_ids if row_ids is None else self.row_ids[row_ids])
+
+    def sort_key(self, name: str, row_ids: np.ndarray) -> Optional[np.ndarray]:
+        return self.table.sort_key(name, self.row_ids[row_ids])
+
+    def find(self, name: str, value: str) -> np.ndarray:
+        return np.flatnonzero(np.isin(self.row_ids, self.table.find(name, value)))
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.row_ids.nbytes + _index_bytes(self._indexes)
+
+
+class Dataset(Table):
+    """A read-only view of one version of a stored dataset."""
+
+    def __init__(self, path: str, meta: Dict, version: Optional[int] = None):
+        self.path = path
+        self.meta = meta
+        self.id = meta["id"]
+        versions = meta["versions"]
+        if version is None:
+            version = versions[-1]["version"]
+        matching = [v for v in versions if v["version"] == version]
+        if not matching:
+            raise KeyError(f"Version {version} of dataset {self.id} not found")
+        self.version = version
+        self.num_rows = matching[0]["num_rows"]
+        # Columns first written by a later version (an append or a correction) are missing here
+        self.columns = [name for name in ALL_COLUMNS
+                        if name in meta["columns"] and meta["columns"][name].get("added", 1) <= version]
+        self.validation_summary = meta.get("validation_summary", {})
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._categories: Dict[str, np.ndarray] = {}
+        self._strings: Dict[str, np.ndarray] = {}
+        self._indexes: Dict[str, ColumnIndex] = {}
+
+    def kind(self, name: str) -> str:
+        # Datasets written before a column became a string column keep their dictionary
+        info = self.meta["columns"].get(name)
+        return info["kind"] if info else column_kind(name)
+
+    def _memmap(self, filename: str, dtype, length: int) -> np.ndarray:
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype, mode="r", shape=(length,))
+
+    def _data_file(self, name: str) -> str:
+        """File stem holding a column's values as of this version."""
+        info = self.meta["columns"][name]
+        stem = info["file"]
+        for revision in info.get("revisions", []):
+            if revision["version"] <= self.version:
+                stem = revision["file"]
+        return stem
+
+    def raw(self, name: str) -> np.ndarray:
+        """Memory-mapped stored values (dictionary codes for text columns)."""
+        if name not in self._arrays:
+            info = self.meta["columns"][name]
+            self._arrays[name] = self._memmap(self._data_file(name) + ".bin", np.dtype(info["dtype"]), self.num_rows)
+        return self._arrays[name]
+
+    def categories(self, name: str) -> np.ndarray:
+        if name not in self._categories:
+            info = self.meta["columns"][name]
+            with open(os.path.join(self.path, info["file"] + ".dict.json")) as f:
+                values = json.load(f)
+            self._categories[name] = np.array(values + [None], dtype=object)
+        return self._categories[name]
+
+    def string_data(self, name: str) -> np.ndarray:
+        if name not in self._strings:
+            length = _string_end(self.raw(name))
+            self._strings[name] = self._memmap(self._data_file(name) + ".bytes", np.uint8, length)
+        return self._strings[name]
+
+    def index(self, name: str) -> Optional[ColumnIndex]:
+        """The index written at ingest time, falling back to one built in memory."""
+        info = self.meta["columns"].get(name)
+        if (name in self._indexes or not self.has_column(name) or "index" not in info or info["index"]["rows"] < self.num_rows
+                or self._data_file(name) != _latest_file(info)):
+            return super().index(name)
+        index_rows = info["index"]["rows"]
+        stem = info["index"].get("file", info["file"])
+        try:
+            postings = self._memmap(stem + ".postings.bin", np.dtype(info["index"]["dtype"]), index_rows)
+            offsets = np.fromfile(os.path.join(self.path, stem + ".offsets.bin"), dtype="<i8")
+        except FileNotFoundError:
+            # Removed after a later version wrote a new index
+            return super().index(name)
+        self._indexes[name] = ColumnIndex(postings, offsets, self.categories(name)[:-1],
+                                          self.num_rows if self.num_rows < index_rows else None)
+        return self._indexes[name]
+
+    def row_hashes(self) -> np.ndarray:
+        """64-bit hash of every row, as computed for duplicate detection at upload."""
+        rows = min(self.num_rows, self.meta.get("hashed_rows", 0))
+        return self._memmap(ROW_HASHES_FILE, np.dtype("<u8"), rows)
+
+    def changes_since(self, version: int) -> Dict:
+        """Rows appended and values corrected after ``version`` up to this one.
+
+        Returns ``{"num_rows": rows at version, "corrections": {column: row ids}}``.
+        """
+        versions = {v["version"]: v for v in self.meta["versions"]}
+        if version not in versions or version > self.version:
+            raise KeyError(f"Version {version} of dataset {self.id} not found")
+        corrections: Dict[str, set] = {}
+        for number in range(version + 1, self.version + 1):
+            for name, rows in versions.get(number, {}).get("corrections", {}).items():
+                corrections.setdefault(name, set()).update(rows)
+        return {
+            "num_rows": versions[version]["num_rows"],
+            "corrections": {name: np.array(sorted(rows), dtype=np.int64) for name, rows in corrections.items()}
+        }
+
+    def summary(self) -> Dict:
+        return {
+            "dataset_id": self.id,
+            "version": self.version,
+            "filename": self.meta.get("filename"),
+            "created_at": self.meta["created_at"],
+            "updated_at": self.meta["updated_at"],
+            "rows": self.num_rows,
+            "columns": self.columns,
+            "versions": self.meta["versions"],
+        }
+
+
+class DatasetWriter:
+    """Appends normalized column chunks to a dataset and commits a new version."""
+
+    def __init__(self, store: "DatasetStore", meta: Dict, is_new: bool):
+        self.store = store
+        # Work on a copy so readers keep seeing the last committed version
+        self.meta = copy.deepcopy(meta)
+        self.is_new = is_new
+        self.path = store.dataset_path(meta["id"])
+        self.base: Optional[Dataset] = None if is_new else store.get(meta["id"])
+        self.start_rows = meta["versions"][-1]["num_rows"] if meta["versions"] else 0
+        self.start_hashed_rows = meta.get("hashed_rows", 0)
+        self.next_version = meta["versions"][-1]["version"] + 1 if meta["versions"] else 1
+        self.rows_written = self.start_rows
+        self._lookups: Dict[str, Dict[str, int]] = {}
+        self._dictionaries: Dict[str, List[str]] = {}
+        self._dirty_dictionaries = set()
+        self._files = {}
+        self._string_files = {}
+        self._string_ends: Dict[str, int] = {}  # bytes of text written to each string column
+        self._hash_file = None
+        self._corrections: Dict[str, set] = {}
+        self._new_files: List[str] = []
+        self._replaced_files: List[str] = []  # removed once the new version is committed
+
+    def _dictionary(self, name: str) -> List[str]:
+        if name not in self._dictionaries:
+            path = os.path.join(self.path, self.meta["columns"][name]["file"] + ".dict.json")
+            values = []
+            if os.path.exists(path):
+                with open(path) as f:
+                    values = json.load(f)
+            self._dictionaries[name] = values
+            self._lookups[name] = {value: code for code, value in enumerate(values)}
+        return self._dictionaries[name]
+
+    def _file(self, name: str):
+        info = self._column_info(name)
+        if name not in self._files:
+            stem = os.path.join(self.path, _latest_file(info))
+            handle = open(stem + ".bin", "ab")
+            if info["kind"] == "string":
+                self._string_files[name] = open(stem + ".bytes", "ab")
+                self._string_ends[name] = self._string_files[name].tell()
+            # Column added after rows were already written: backfill defaults
+            existing = handle.tell() // _KIND_DTYPES[info["kind"]].itemsize
+            if existing < self.rows_written:
+                handle.write(self._missing(name, self.rows_written - existing).tobytes())
+            self._files[name] = handle
+        return self._files[name]
+
+    @staticmethod
+    def _defaults(kind: str, length: int) -> np.ndarray:
+        return np.full(length, _KIND_DEFAULTS[kind], dtype=_KIND_DTYPES[kind])
+
+    def _missing(self, name: str, length: int) -> np.ndarray:
+        """Stored values of ``length`` rows with no value for column ``name``."""
+        kind = self.meta["columns"][name]["kind"]
+        if kind == "string":
+            return np.full(length, ~self._string_ends[name], dtype=_KIND_DTYPES[kind])
+        return self._defaults(kind, length)
+
+    def _encode(self, name: str, values: np.ndarray) -> np.ndarray:
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        dictionary = self._dictionary(name)
+        lookup = self._lookups[name]
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        mapping[-1] = -1
+        for i, value in enumerate(uniques):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(dictionary)
+                dictionary.append(value)
+                self._dirty_dictionaries.add(name)
+            mapping[i] = code
+        return mapping[codes]
+
+    def write(self, columns: Dict[str, np.ndarray], length: int) -> None:
+        """Append ``length`` normalized rows (see ``normalize_frame``)."""
+        names = set(self.meta["columns"]) | set(columns)
+        for name in names:
+            handle = self._file(name)
+            kind = self.meta["columns"][name]["kind"]
+            if name not in columns:
+                values = self._missing(name, length)
+            elif kind == "category":
+                values = self._encode(name, columns[name])
+            elif kind == "string":
+                values, data = _encode_strings(columns[name], self._string_ends[name])
+                self._string_files[name].write(data)
+                self._string_ends[name] += len(data)
+            else:
+                values = np.asarray(columns[name], dtype=_KIND_DTYPES[kind])
+            handle.write(values.tobytes())
+        self.rows_written += length
+
+    def write_hashes(self, hashes: np.ndarray) -> None:
+        """Append the row hashes of the rows just written, for later duplicate checks."""
+        if self._hash_file is None:
+            self._hash_file = open(os.path.join(self.path, ROW_HASHES_FILE), "ab")
+        self._hash_file.write(np.asarray(hashes, dtype="<u8").tobytes())
+        self.meta["hashed_rows"] = self.meta.get("hashed_rows", 0) + len(hashes)
+
+    def correct(self, name: str, row_ids: np.ndarray, values: np.ndarray) -> None:
+        """Overwrite values of existing rows in the next version.
+
+        The column is copied to a new revision file first, so earlier
+        versions keep reading their original values.
+        """
+        if self._files:
+            raise ValueError("Cannot correct values and append rows in the same version")
+        info = self._column_info(name)
+        kind = info["kind"]
+        source = os.path.join(self.path, _latest_file(info))
+        if name not in self._corrections:
+            stem = f"{info['file']}.v{self.next_version}"
+            target = os.path.join(self.path, stem)
+            if kind == "string":
+                pass  # Rewritten whole below
+            elif os.path.exists(source + ".bin"):
+                shutil.copyfile(source + ".bin", target + ".bin")
+            else:
+                self._defaults(kind, self.rows_written).tofile(target + ".bin")
+            self._new_files.append(target + ".bin")
+            if kind == "string":
+                self._new_files.append(target + ".bytes")
+            info.setdefault("revisions", []).append({"version": self.next_version, "file": stem})
+            self._corrections[name] = set()
+        target = os.path.join(self.path, _latest_file(info))
+        if kind == "string":
+            self._rewrite_strings(source, target, row_ids, values)
+        else:
+            values = self._encode(name, values) if kind == "category" else np.asarray(values, dtype=_KIND_DTYPES[kind])
+            column = np.memmap(target + ".bin", dtype=_KIND_DTYPES[kind], mode="r+", shape=(self.rows_written,))
+            column[row_ids] = values
+            column.flush()
+            del column
+        self._corrections[name].update(int(row) for row in row_ids)
+
+    def _rewrite_strings(self, source: str, target: str, row_ids: np.ndarray, values: np.ndarray) -> None:
+        # Text has variable length, so a corrected string column is re-encoded whole
+        if os.path.exists(source + ".bin"):
+            ends = np.fromfile(source + ".bin", dtype=_KIND_DTYPES["string"], count=self.rows_written)
+            current = _decode_strings(ends, np.fromfile(source + ".bytes", dtype=np.uint8))
+        else:
+            current = np.full(self.rows_written, None, dtype=object)
+        current[row_ids] = values
+        ends, data = _encode_strings(current, 0)
+        ends.tofile(target + ".bin")
+        with open(target + ".bytes", "wb") as f:
+            f.write(data)
+
+    def _column_info(self, name: str) -> Dict:
+        if name not in self.meta["columns"]:
+            kind = column_kind(name)
+            self.meta["columns"][name] = {"file": _column_file(name), "kind": kind,
+                                          "dtype": _KIND_DTYPES[kind].str, "added": self.next_version}
+        return self.meta["columns"][name]
+
+    def _close_files(self) -> None:
+        for handle in list(self._files.values()) + list(self._string_files.values()):
+            handle.close()
+        self._files = {}
+        self._string_files = {}
+        if self._hash_file is not None:
+            self._hash_file.close()
+            self._hash_file = None
+
+    def _write_index(self, name: str) -> None:
+        info = self.meta["columns"][name]
+        codes = np.fromfile(os.path.join(self.path, _latest_file(info) + ".bin"), dtype=info["dtype"],
+                            count=self.rows_written)
+        index = ColumnIndex.build(codes, np.empty(len(self._dictionary(name)), dtype=object))
+        # New files rather than overwriting, since older versions may have the old index mapped
+        stem = f"{info['file']}.i{self.next_version}"
+        for suffix, values in ((".postings.bin", index.postings), (".offsets.bin", index.offsets)):
+            values.tofile(os.path.join(self.path, stem + suffix))
+            self._new_files.append(os.path.join(self.path, stem + suffix))
+            if "index" in info:
+                self._replaced_files.append(os.path.join(self.path, info["index"].get("file", info["file"]) + suffix))
+        info["index"] = {"rows": self.rows_written, "dtype": index.postings.dtype.str, "file": stem}
+
+    def commit(self, validation_summary: Optional[Dict] = None, filename: Optional[str] = None) -> Dataset:
+        """Flush column files and record a new dataset version."""
+        # Make sure every column covers every row, even if no chunk touched it
+        if self.rows_written > self.start_rows:
+            for name in self.meta["columns"]:
+                self._file(name)
+        self._close_files()
+        for name in self._dirty_dictionaries:
+            path = os.path.join(self.path, self.meta["columns"][name]["file"] + ".dict.json")
+            _write_json(path, self._dictionaries[name])
+        for name in INDEXED_COLUMNS:
+            if name in self.meta["columns"] and (self.rows_written > self.start_rows or name in self._corrections):
+                self._write_index(name)
+
+        now = datetime.now().isoformat()
+        versions = self.meta["versions"]
+        version = {
+            "version": self.next_version,
+            "num_rows": self.rows_written,
+            "created_at": now,
+            "filename": filename or self.meta.get("filename"),
+        }
+        if self._corrections:
+            version["corrections"] = {name: sorted(rows) for name, rows in self._corrections.items()}
+        versions.append(version)
+        self.meta["updated_at"] = now
+        if validation_summary is not None:
+            self.meta["validation_summary"] = validation_summary
+        _write_json(os.path.join(self.path, META_FILE), self.meta)
+        self.store.datasets[self.meta["id"]] = self.meta
+        self.store.writing.discard(self.meta["id"])
+        for path in self._replaced_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped (on Windows) or already gone; only costs disk space
+        return self.store.get(self.meta["id"])
+
+    def abort(self) -> None:
+        """Discard everything written since the writer was opened."""
+        self._close_files()
+        self.store.writing.discard(self.meta["id"])
+        if self.is_new:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        for path in self._new_files:
+            if os.path.exists(path):
+                os.remove(path)
+        for info in self.meta["columns"].values():
+            stem = os.path.join(self.path, _latest_file(info))
+            if not os.path.exists(stem + ".bin"):
+                continue
+            if info["kind"] == "string" and os.path.exists(stem + ".bytes"):
+                ends = np.fromfile(stem + ".bin", dtype=_KIND_DTYPES["string"], count=self.start_rows)
+                os.truncate(stem + ".bytes", _string_end(ends))
+            os.truncate(stem + ".bin", self.start_rows * _KIND_DTYPES[info["kind"]].itemsize)
+        hashes_path = os.path.join(self.path, ROW_HASHES_FILE)
+        if os.path.exists(hashes_path):
+            os.truncate(hashes_path, self.start_hashed_rows * 8)
+
+
+class DatasetStore:
+    """Registry of datasets persisted under a local directory."""
+
+    def __init__(self, root: str = DATA_DIR):
+        self.root = root
+        self.datasets: Dict[str, Dict] = {}
+        self.writing = set()  # ids of datasets with an open writer
+        self._open: "OrderedDict[Tuple[str, int], Dataset]" = OrderedDict()  # recently used versions
+        self._lock = threading.Lock()
+        self.load()
+
+    def dataset_path(self, dataset_id: str) -> str:
+        return os.path.join(self.root, dataset_id)
+
+    def load(self) -> None:
+        """Reopen every committed dataset found on disk."""
+        os.makedirs(self.root, exist_ok=True)
+        for entry in os.listdir(self.root):
+            meta_path = os.path.join(self.root, entry, META_FILE)
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("versions"):
+                self.datasets[meta["id"]] = meta
+
+    def create(self, filename: Optional[str] = None) -> DatasetWriter:
+        dataset_id = uuid.uuid4().hex[:12]
+        os.makedirs(self.dataset_path(dataset_id))
+        now = datetime.now().isoformat()
+        meta = {
+            "id": dataset_id,
+            "filename": filename,
+            "created_at": now,
+            "updated_at": now,
+            "columns": {},
+            "versions": [],
+        }
+        return DatasetWriter(self, meta, is_new=True)
+
+    def open(self, dataset_id: str) -> DatasetWriter:
+        """A writer that appends to or corrects an existing dataset.
+
+        Only one writer can be open on a dataset at a time.
+        """
+        if dataset_id not in self.datasets:
+            raise KeyError(f"Dataset {dataset_id} not found")
+        with self._lock:
+            if dataset_id in self.writing:
+                raise DatasetBusyError(f"Dataset {dataset_id} is already being updated")
+            self.writing.add(dataset_id)
+        return DatasetWriter(self, self.datasets[dataset_id], is_new=False)
+
+    def get(self, dataset_id: str, version: Optional[int] = None) -> Dataset:
+        """A version of a dataset, by default the latest, kept open for later requests."""
+        if dataset_id not in self.datasets:
+            raise KeyError(f"Dataset {dataset_id} not found")
+        meta = self.datasets[dataset_id]
+        key = (dataset_id, meta["versions"][-1]["version"] if version is None else version)
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                return self._open[key]
+        dataset = Dataset(self.dataset_path(dataset_id), meta, key[1])
+        with self._lock:
+            dataset = self._open.setdefault(key, dataset)
+            while len(self._open) > OPEN_DATASETS:
+                self._open.popitem(last=False)
+        return dataset
+
+    def latest(self) -> Optional[Dataset]:
+        """The most recently updated dataset, if any."""
+        if not self.datasets:
+            return None
+        meta = max(self.datasets.values(), key=lambda m: m["updated_at"])
+        return self.get(meta["id"])
+
+    def list(self) -> List[Dict]:
+        return [self.get(dataset_id).summary() for dataset_id in self.datasets]
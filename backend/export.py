@@ -0,0 +1,123 @@
+"""Streaming exports of datasets and calculation results.
+
+Rows are written ``EXPORT_CHUNK_ROWS`` at a time straight from the stored
+and computed column arrays, so an export starts streaming immediately and
+the server only ever holds one chunk in memory. Supported formats:
+
+    csv     header line, then one line per row
+    ndjson  one JSON object per line
+    arrow   Apache Arrow IPC stream, one record batch per chunk
+
+For calculation results the formula is sent once, in the
+``X-Formula-Used`` response header, instead of on every row.
+"""
+import os
+from typing import Iterator, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from schema import INT_COLUMNS, NUMERIC_COLUMNS
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("FORMULA_BUILDER_EXPORT_CHUNK_ROWS", 65_536))
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+RowIds = Union[np.ndarray, range]
+
+
+class ExportError(ValueError):
+    """Raised for unknown export formats."""
+
+
+def check_format(export_format: str) -> str:
+    export_format = export_format.lower()
+    if export_format not in MEDIA_TYPES:
+        raise ExportError(f"Unknown export format '{export_format}'; use {', '.join(MEDIA_TYPES)}")
+    return export_format
+
+
+def _frames(source, row_ids: RowIds, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # ``source`` is a Table or CalculationResult; both provide to_frame(row_ids)
+    if not len(row_ids):
+        yield source.to_frame(np.empty(0, dtype=np.int64))
+    for start in range(0, len(row_ids), chunk_rows):
+        yield source.to_frame(np.asarray(row_ids[start:start + chunk_rows], dtype=np.int64))
+
+
+def _csv(frames: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def _ndjson(frames: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    for frame in frames:
+        if len(frame):
+            yield frame.to_json(orient="records", lines=True).encode().rstrip(b"\n") + b"\n"
+
+
+class _Buffer:
+    """Write target that hands over what was written since the last drain."""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def _arrow_schema(columns: Sequence[str]):
+    import pyarrow as pa
+
+    fields = []
+    for name in columns:
+        if name in INT_COLUMNS:
+            fields.append(pa.field(name, pa.int64()))
+        elif name in NUMERIC_COLUMNS or name == "Calculated Price":
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def _arrow(frames: Iterator[pd.DataFrame], columns: Sequence[str]) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = _arrow_schema(columns)
+    buffer = _Buffer()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        for frame in frames:
+            writer.write_batch(pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False))
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def stream_export(source, row_ids: RowIds, export_format: str,
+                  chunk_rows: Optional[int] = None) -> Iterator[bytes]:
+    """Encoded chunks of the rows ``row_ids`` of a table or calculation result."""
+    frames = _frames(source, row_ids, chunk_rows or EXPORT_CHUNK_ROWS)
+    if export_format == "csv":
+        return _csv(frames)
+    if export_format == "ndjson":
+        return _ndjson(frames)
+    # Schema from an empty frame, so a chunk with only missing text still matches
+    columns = list(source.to_frame(np.empty(0, dtype=np.int64)).columns)
+    return _arrow(frames, columns)
@@ -0,0 +1,468 @@
+"""Formula parsing and vectorized evaluation.
+
+A formula string such as ``Total Sales * (1 - (Discount Percentage / 100))``
+is parsed once into a small expression tree, validated against the known
+columns in ``schema`` and compiled into a chain of whole-column NumPy
+operations. Evaluating a compiled formula over a dataset is then a single
+pass over the referenced columns rather than a Python loop over rows.
+
+Supported syntax:
+    numbers, quoted strings, column names (with or without unit suffix)
+    + - * / ^ and unary minus
+    < <= > >= == != (``=`` is accepted as ``==``)
+    min(a, b, ...), max(a, b, ...), abs(x), round(x[, digits]), if(cond, a, b)
+
+Missing numeric values (NaN, None or the "--" sentinel) are treated as 0,
+matching how uploads are normalized, and are reported through a mask.
+
+Several formulas can be evaluated together as a ``FormulaBatch``; a
+subexpression that appears more than once across them (compared by its
+canonical expression) is computed once per evaluation.
+"""
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from schema import NUMERIC_COLUMNS, VARIABLE_ALIASES
+
+
+class FormulaError(ValueError):
+    """Raised when a formula cannot be parsed or refers to unknown columns."""
+
+
+# Expression tree nodes
+class Number(NamedTuple):
+    value: float
+
+
+class String(NamedTuple):
+    value: str
+
+
+class Column(NamedTuple):
+    name: str
+
+
+class Unary(NamedTuple):
+    op: str
+    operand: tuple
+
+
+class Binary(NamedTuple):
+    op: str
+    left: tuple
+    right: tuple
+
+
+class Call(NamedTuple):
+    name: str
+    args: tuple
+
+
+FUNCTIONS = {
+    # name: (min args, max args or None)
+    'min': (1, None),
+    'max': (1, None),
+    'abs': (1, 1),
+    'round': (1, 2),
+    'if': (3, 3),
+}
+
+COMPARISONS = ('<', '<=', '>', '>=', '==', '!=')
+
+_NUMBER = re.compile(r'(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?')
+_STRING = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+_WORD = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_OPERATORS = ('<=', '>=', '==', '!=', '<', '>', '=', '+', '-', '*', '/', '^', '(', ')', ',')
+# Longest aliases first so "Sale Price" wins over a shorter prefix
+_ALIASES = sorted(VARIABLE_ALIASES.items(), key=lambda item: -len(item[0]))
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def tokenize(formula_string: str):
+    """Split a formula into (kind, value) tokens."""
+    tokens = []
+    text = formula_string
+    lowered = text.lower()
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char.isspace():
+            pos += 1
+            continue
+
+        match = _NUMBER.match(text, pos)
+        if match:
+            tokens.append(('number', float(match.group(0))))
+            pos = match.end()
+            continue
+
+        match = _STRING.match(text, pos)
+        if match:
+            value = match.group(1) if match.group(1) is not None else match.group(2)
+            tokens.append(('string', value))
+            pos = match.end()
+            continue
+
+        if char.isalpha() or char == '_':
+            word = _WORD.match(text, pos)
+            rest = text[word.end():].lstrip()
+            if word.group(0).lower() in FUNCTIONS and rest.startswith('('):
+                tokens.append(('function', word.group(0).lower()))
+                pos = word.end()
+                continue
+
+            for alias, column in _ALIASES:
+                end = pos + len(alias)
+                if lowered.startswith(alias, pos) and (end == len(text) or not _is_word_char(text[end])):
+                    tokens.append(('column', column))
+                    pos = end
+                    break
+            else:
+                raise FormulaError(f"Unknown variable '{word.group(0)}' at position {pos + 1}")
+            continue
+
+        for op in _OPERATORS:
+            if text.startswith(op, pos):
+                tokens.append(('op', '==' if op == '=' else op))
+                pos += len(op)
+                break
+        else:
+            raise FormulaError(f"Unexpected character '{char}' at position {pos + 1}")
+
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, token = self.take()
+        if kind != 'op' or token != value:
+            found = 'end of formula' if kind is None else f"'{token}'"
+            raise FormulaError(f"Expected '{value}' but found {found}")
+
+    def parse(self):
+        if not self.tokens:
+            raise FormulaError("Formula is empty")
+        node = self.comparison()
+        if self.pos < len(self.tokens):
+            raise FormulaError(f"Unexpected '{self.peek()[1]}' after end of expression")
+        return node
+
+    def comparison(self):
+        node = self.additive()
+        kind, op = self.peek()
+        if kind == 'op' and op in COMPARISONS:
+            self.take()
+            node = Binary(op, node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            node = Binary(op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            node = Binary(op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() in (('op', '-'), ('op', '+')):
+            op = self.take()[1]
+            operand = self.unary()
+            return Unary('-', operand) if op == '-' else operand
+        return self.power()
+
+    def power(self):
+        node = self.primary()
+        if self.peek() == ('op', '^'):
+            self.take()
+            node = Binary('^', node, self.unary())
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return Number(value)
+        if kind == 'string':
+            return String(value)
+        if kind == 'column':
+            return Column(value)
+        if kind == 'function':
+            self.expect('(')
+            args = []
+            if self.peek() != ('op', ')'):
+                args.append(self.comparison())
+                while self.peek() == ('op', ','):
+                    self.take()
+                    args.append(self.comparison())
+            self.expect(')')
+            return Call(value, tuple(args))
+        if (kind, value) == ('op', '('):
+            node = self.comparison()
+            self.expect(')')
+            return node
+        found = 'end of formula' if kind is None else f"'{value}'"
+        raise FormulaError(f"Expected a number, variable or '(' but found {found}")
+
+
+def parse(formula_string: str):
+    """Parse a formula string into an expression tree."""
+    return _Parser(tokenize(formula_string)).parse()
+
+
+def _check(node) -> str:
+    """Validate a tree and return its result type: 'number', 'bool' or 'text'."""
+    if isinstance(node, Number):
+        return 'number'
+    if isinstance(node, String):
+        return 'text'
+    if isinstance(node, Column):
+        return 'number' if node.name in NUMERIC_COLUMNS else 'text'
+    if isinstance(node, Unary):
+        if _check(node.operand) == 'text':
+            raise FormulaError("Cannot negate a text value")
+        return 'number'
+    if isinstance(node, Binary):
+        left, right = _check(node.left), _check(node.right)
+        if node.op in COMPARISONS:
+            if (left == 'text') != (right == 'text'):
+                raise FormulaError(f"Cannot compare text with a number using '{node.op}'")
+            if left == 'text' and node.op not in ('==', '!='):
+                raise FormulaError(f"Text values can only be compared with '==' or '!='")
+            return 'bool'
+        if 'text' in (left, right):
+            raise FormulaError(f"Cannot use '{node.op}' on a text value")
+        return 'number'
+    if isinstance(node, Call):
+        low, high = FUNCTIONS[node.name]
+        if len(node.args) < low or (high is not None and len(node.args) > high):
+            raise FormulaError(f"Wrong number of arguments to {node.name}()")
+        types = [_check(arg) for arg in node.args]
+        if node.name == 'if':
+            if types[0] == 'text' or 'text' in types[1:]:
+                raise FormulaError("if() needs a condition and two numeric values")
+            return 'number'
+        if 'text' in types:
+            raise FormulaError(f"{node.name}() only accepts numeric values")
+        if node.name == 'round' and len(node.args) == 2 and not isinstance(node.args[1], Number):
+            raise FormulaError("round() digits must be a constant number")
+        return 'number'
+    raise FormulaError(f"Unsupported expression: {node!r}")
+
+
+def referenced_columns(node) -> set:
+    """Return the set of column names a tree reads."""
+    if isinstance(node, Column):
+        return {node.name}
+    if isinstance(node, Unary):
+        return referenced_columns(node.operand)
+    if isinstance(node, Binary):
+        return referenced_columns(node.left) | referenced_columns(node.right)
+    if isinstance(node, Call):
+        return set().union(*(referenced_columns(arg) for arg in node.args))
+    return set()
+
+
+def subexpressions(node) -> Iterator[str]:
+    """Yield the canonical expression of every operation in a tree, innermost first."""
+    if isinstance(node, Unary):
+        yield from subexpressions(node.operand)
+    elif isinstance(node, Binary):
+        yield from subexpressions(node.left)
+        yield from subexpressions(node.right)
+    elif isinstance(node, Call):
+        for arg in node.args:
+            yield from subexpressions(arg)
+    else:
+        return
+    yield to_expression(node)
+
+
+def to_expression(node) -> str:
+    """Render a tree as a canonical, fully parenthesized formula string."""
+    if isinstance(node, Number):
+        return repr(node.value)
+    if isinstance(node, String):
+        return '"' + node.value + '"'
+    if isinstance(node, Column):
+        return node.name
+    if isinstance(node, Unary):
+        return f"(-{to_expression(node.operand)})"
+    if isinstance(node, Binary):
+        return f"({to_expression(node.left)} {node.op} {to_expression(node.right)})"
+    return f"{node.name}({', '.join(to_expression(arg) for arg in node.args)})"
+
+
+class _Environment:
+    """Column lookups for one evaluation, with missing values masked out."""
+
+    def __init__(self, columns: Mapping[str, np.ndarray], length: int):
+        self.columns = columns
+        self.length = length
+        self.values: Dict[str, np.ndarray] = {}
+        self.missing_masks: Dict[str, np.ndarray] = {}
+        self.shared: Dict[str, np.ndarray] = {}  # expression -> value, for subexpressions of a FormulaBatch
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.values:
+            if name not in self.columns:
+                raise FormulaError(f"Column '{name}' is not available in the data")
+            raw = self.columns[name]
+            if name in NUMERIC_COLUMNS:
+                raw = np.asarray(raw, dtype=np.float64)
+                missing = np.isnan(raw)
+                self.missing_masks[name] = missing
+                self.values[name] = np.where(missing, 0.0, raw)
+            else:
+                self.values[name] = np.asarray(raw, dtype=object)
+        return self.values[name]
+
+    def missing(self, names: Iterable[str]) -> np.ndarray:
+        """Mask of rows where any of the columns ``names`` is missing."""
+        mask = np.zeros(self.length, dtype=bool)
+        for name in names:
+            if name in self.missing_masks:
+                mask |= self.missing_masks[name]
+        return mask
+
+
+_BINARY_OPS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.divide,
+    '^': np.power,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+def _compile(node, shared: frozenset = frozenset()):
+    """Turn a validated tree into a function of an _Environment.
+
+    Subexpressions whose canonical expression is in ``shared`` are computed
+    once per environment and reused.
+    """
+    evaluate = _compile_node(node, shared)
+    if not shared or isinstance(node, (Number, String, Column)):
+        return evaluate
+    expression = to_expression(node)
+    if expression not in shared:
+        return evaluate
+
+    def evaluate_shared(env):
+        if expression not in env.shared:
+            env.shared[expression] = evaluate(env)
+        return env.shared[expression]
+    return evaluate_shared
+
+
+def _compile_node(node, shared: frozenset):
+    if isinstance(node, (Number, String)):
+        value = node.value
+        return lambda env: value
+    if isinstance(node, Column):
+        name = node.name
+        return lambda env: env.column(name)
+    if isinstance(node, Unary):
+        operand = _compile(node.operand, shared)
+        return lambda env: np.negative(operand(env))
+    if isinstance(node, Binary):
+        func = _BINARY_OPS[node.op]
+        left, right = _compile(node.left, shared), _compile(node.right, shared)
+        if node.op in ('==', '!=') and (isinstance(node.left, String) or isinstance(node.right, String)):
+            # Elementwise comparison of an object array against a string
+            return lambda env: func(np.asarray(left(env), dtype=object), right(env)).astype(bool)
+        return lambda env: func(left(env), right(env))
+
+    args = [_compile(arg, shared) for arg in node.args]
+    if node.name == 'min':
+        return lambda env: np.minimum.reduce(np.broadcast_arrays(*(arg(env) for arg in args)))
+    if node.name == 'max':
+        return lambda env: np.maximum.reduce(np.broadcast_arrays(*(arg(env) for arg in args)))
+    if node.name == 'abs':
+        return lambda env: np.abs(args[0](env))
+    if node.name == 'round':
+        digits = int(node.args[1].value) if len(node.args) == 2 else 0
+        return lambda env: np.round(args[0](env), digits)
+    condition, when_true, when_false = args
+    return lambda env: np.where(condition(env), when_true(env), when_false(env))
+
+
+class CompiledFormula:
+    """A parsed and validated formula ready to evaluate over column arrays."""
+
+    def __init__(self, formula_string: str):
+        self.formula_string = formula_string
+        self.tree = parse(formula_string)
+        if _check(self.tree) == 'text':
+            raise FormulaError("Formula must produce a number, not text")
+        self.columns = frozenset(referenced_columns(self.tree))
+        self.expression = to_expression(self.tree)
+        self._evaluate = _compile(self.tree)
+
+    def evaluate(self, columns: Mapping[str, np.ndarray], length: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Evaluate over ``length`` rows.
+
+        ``columns`` maps column names to arrays; numeric columns use NaN for
+        missing values. Returns the float results and a mask of rows where
+        any referenced input was missing.
+        """
+        env = _Environment(columns, length)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = self._evaluate(env)
+        result = np.broadcast_to(np.asarray(result, dtype=np.float64), (length,))
+        return result, env.missing(self.columns)
+
+
+def compile_formula(formula_string: str) -> CompiledFormula:
+    return CompiledFormula(formula_string)
+
+
+class FormulaBatch:
+    """Several compiled formulas evaluated in one pass over the same columns."""
+
+    def __init__(self, formulas: Sequence[CompiledFormula]):
+        self.formulas = list(formulas)
+        self.columns = frozenset().union(*(formula.columns for formula in self.formulas))
+        counts = Counter(expression for formula in self.formulas for expression in subexpressions(formula.tree))
+        # Subexpressions used more than once, whether in one formula or across several
+        self.shared = frozenset(expression for expression, count in counts.items() if count > 1)
+        self._evaluators = [_compile(formula.tree, self.shared) for formula in self.formulas]
+
+    def evaluate(self, columns: Mapping[str, np.ndarray], length: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Evaluate every formula over ``length`` rows; returns (results, missing mask) per formula."""
+        env = _Environment(columns, length)
+        outputs = []
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for formula, evaluate in zip(self.formulas, self._evaluators):
+                result = np.broadcast_to(np.asarray(evaluate(env), dtype=np.float64), (length,))
+                outputs.append((result, env.missing(formula.columns)))
+        return outputs
+
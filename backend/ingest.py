@@ -0,0 +1,301 @@
+"""Streaming ingestion of uploaded CSV/XLS/XLSX files into the dataset store.
+
+Uploads are first spooled to a temporary file, then parsed in chunks of
+``CHUNK_ROWS`` rows. Each chunk is renamed, validated, normalized and
+appended to a ``DatasetWriter`` before the next one is read, so peak memory
+depends on the chunk size rather than the file size. The validation summary
+counters are accumulated chunk by chunk; duplicates are detected with a set
+of 64-bit row hashes. The hashes are stored with the dataset, so rows
+appended to it later are also checked against the rows already there.
+"""
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import UploadFile
+
+from dataset_store import Dataset, DatasetWriter, normalize_frame
+from metrics import Timings, activate, count_rows, deactivate, stage
+from schema import COLUMN_MAPPING, MINIMUM_REQUIRED_COLUMNS, TEXT_COLUMNS
+
+CHUNK_ROWS = int(os.environ.get("FORMULA_BUILDER_CHUNK_ROWS", 100_000))
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+# Read text columns as strings so "2021" is not parsed as 2021 in one chunk and 2021.0 in another
+_TEXT_DTYPES = {uploaded: str for uploaded, internal in COLUMN_MAPPING.items() if internal in TEXT_COLUMNS}
+
+
+class IngestError(ValueError):
+    """Raised when an uploaded file cannot be read or is missing required columns."""
+
+
+async def spool_upload(file: UploadFile) -> str:
+    """Copy an upload to a temporary file in fixed-size blocks and return its path."""
+    suffix = os.path.splitext(file.filename)[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as spool:
+        while True:
+            block = await file.read(SPOOL_BLOCK_SIZE)
+            if not block:
+                break
+            spool.write(block)
+    return spool.name
+
+
+def _read_csv_chunks(path: str, chunk_rows: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+    total = os.path.getsize(path) or 1
+    with open(path, "rb") as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_rows, dtype=_TEXT_DTYPES):
+            yield chunk, min(f.tell() / total, 1.0)
+
+
+def _cell_text(value) -> Optional[str]:
+    """A spreadsheet cell as text; whole numbers read as 2021, not 2021.0."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _sheet_frame(rows: list, header: list) -> pd.DataFrame:
+    # Object columns keep each cell's own type, so a blank cell cannot turn a chunk's years into floats
+    frame = pd.DataFrame(rows, columns=header, dtype=object)
+    for name in frame.columns:
+        if name in _TEXT_DTYPES:
+            frame[name] = frame[name].map(_cell_text).astype(object)
+    return frame
+
+
+def _read_xlsx_chunks(path: str, chunk_rows: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        total = max((sheet.max_row or 1) - 1, 1)
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise IngestError("Error reading file: No columns to parse from file")
+        header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+        batch = []
+        done = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                done += len(batch)
+                yield _sheet_frame(batch, header), min(done / total, 1.0)
+                batch = []
+        if batch or not done:
+            yield _sheet_frame(batch, header), 1.0
+    finally:
+        workbook.close()
+
+
+def _read_xls_chunks(path: str, chunk_rows: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+    # The legacy binary format has no streaming reader; read it in one go
+    yield pd.read_excel(path, dtype=_TEXT_DTYPES), 1.0
+
+
+def read_chunks(path: str, filename: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[pd.DataFrame, float]]:
+    """Yield (chunk, fraction of the file read) pairs."""
+    if filename.endswith('.csv'):
+        return _read_csv_chunks(path, chunk_rows)
+    if filename.endswith('.xlsx'):
+        return _read_xlsx_chunks(path, chunk_rows)
+    return _read_xls_chunks(path, chunk_rows)
+
+
+class _RowHashSet:
+    """Set of 64-bit row hashes kept as a few sorted arrays of doubling size."""
+
+    def __init__(self):
+        self.levels = []
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(hashes), dtype=bool)
+        for level in self.levels:
+            positions = np.minimum(np.searchsorted(level, hashes), len(level) - 1)
+            found |= level[positions] == hashes
+        return found
+
+    def add(self, hashes: np.ndarray) -> None:
+        level = np.sort(hashes)
+        # Merge equal-sized levels so there are only O(log n) to search
+        while self.levels and len(self.levels[-1]) <= len(level):
+            level = np.union1d(self.levels.pop(), level)
+        self.levels.append(level)
+
+
+class ValidationCounter:
+    """Accumulates the upload validation summary one chunk at a time.
+
+    When appending, the counts start from the summary of ``base``.
+    """
+
+    def __init__(self, base: Optional[Dataset] = None):
+        summary = base.validation_summary if base is not None else {}
+        self.missing_discounts = summary.get("missing_discounts", 0)
+        self.govt_transactions = summary.get("govt_transactions", 0)
+        self.duplicate_transactions = summary.get("duplicate_transactions", 0)
+        self.available_columns = list(summary["available_columns"]) if "available_columns" in summary else None
+        self._seen = _RowHashSet()
+        if base is not None and len(base.row_hashes()):
+            self._seen.add(np.unique(base.row_hashes()))
+
+    def update(self, df: pd.DataFrame, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Count a chunk and return its row hashes."""
+        if self.available_columns is None:
+            self.available_columns = df.columns.tolist()
+        else:
+            self.available_columns += [col for col in df.columns if col not in self.available_columns]
+        if "Discount" in df.columns:
+            self.missing_discounts += int(df["Discount"].isna().sum())
+        if "Customer" in df.columns:
+            self.govt_transactions += int((df["Customer"] == "Government").sum())
+
+        # Hash normalized values so the same row hashes alike in every chunk
+        hashed = pd.DataFrame({
+            name: columns[name] if name in columns else df[name].astype(str)
+            for name in df.columns
+        })
+        hashes = pd.util.hash_pandas_object(hashed, index=False).to_numpy()
+        duplicate = pd.Series(hashes).duplicated().to_numpy()
+        duplicate |= self._seen.contains(hashes)
+        self.duplicate_transactions += int(duplicate.sum())
+        self._seen.add(np.unique(hashes))
+        return hashes
+
+    def summary(self) -> Dict:
+        return {
+            "missing_discounts": self.missing_discounts,
+            "govt_transactions": self.govt_transactions,
+            "duplicate_transactions": self.duplicate_transactions,
+            "total_columns": len(self.available_columns or []),
+            "available_columns": self.available_columns or []
+        }
+
+
+def _check_columns(chunk: pd.DataFrame) -> None:
+    missing_columns = [col for col in MINIMUM_REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing_columns:
+        available_columns = chunk.columns.tolist()
+        raise IngestError(
+            f"Missing minimum required columns: {', '.join(missing_columns)}\n"
+            f"Available columns in file: {', '.join(available_columns)}"
+        )
+
+
+def ingest_file(path: str, filename: str, writer: DatasetWriter,
+                on_progress: Optional[Callable[[float, int], None]] = None,
+                chunk_rows: int = CHUNK_ROWS) -> Dataset:
+    """Stream a spooled upload into ``writer`` and commit it as a new version.
+
+    If ``writer`` was opened on an existing dataset the rows are appended to
+    it. ``on_progress`` is called after every chunk with the fraction of the file
+    read and the number of rows ingested so far.
+    """
+    counter = ValidationCounter(writer.base)
+    rows = 0
+    try:
+        chunks = read_chunks(path, filename, chunk_rows)
+        while True:
+            try:
+                with stage("parse"):
+                    chunk, fraction = next(chunks)
+            except StopIteration:
+                break
+            except IngestError:
+                raise
+            except Exception as e:
+                raise IngestError(f"Error reading file: {str(e)}")
+
+            if rows == 0:
+                with stage("validate"):
+                    _check_columns(chunk)
+            with stage("normalize"):
+                chunk = chunk.rename(columns={col: COLUMN_MAPPING[col] for col in chunk.columns if col in COLUMN_MAPPING})
+                columns = normalize_frame(chunk)
+            with stage("validate"):
+                hashes = counter.update(chunk, columns)
+            with stage("store"):
+                writer.write(columns, len(chunk))
+                writer.write_hashes(hashes)
+            rows += len(chunk)
+            count_rows(len(chunk))
+            if on_progress:
+                on_progress(fraction, rows)
+
+        if rows == 0:
+            raise IngestError("No valid data could be processed from the file")
+        with stage("store"):
+            return writer.commit(counter.summary(), filename=filename)
+    except Exception:
+        writer.abort()
+        raise
+
+
+class IngestJob:
+    """A background upload, with progress that can be polled while it runs."""
+
+    def __init__(self, path: str, filename: str, writer: DatasetWriter):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.filename = filename
+        self.writer = writer
+        self.status = "queued"
+        self.progress = 0.0
+        self.rows_processed = 0
+        self.error: Optional[str] = None
+        self.result: Optional[Dict] = None
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.timings = Timings()
+
+    def _update(self, fraction: float, rows: int) -> None:
+        self.progress = fraction
+        self.rows_processed = rows
+
+    def run(self) -> None:
+        self.status = "running"
+        token = activate(self.timings)
+        try:
+            dataset = ingest_file(self.path, self.filename, self.writer, on_progress=self._update)
+            self.result = {
+                "dataset_id": dataset.id,
+                "version": dataset.version,
+                "rows": len(dataset),
+                "validation_summary": dataset.validation_summary
+            }
+            self.progress = 1.0
+            self.status = "completed"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = datetime.now().isoformat()
+            self.writer = None  # Committed or aborted; don't hold on to its dictionaries
+            deactivate(token)
+            os.remove(self.path)
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name=f"ingest-{self.id}", daemon=True).start()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "rows_processed": self.rows_processed,
+            "error": self.error,
+            "result": self.result,
+            "timings_ms": self.timings.to_dict(),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
@@ -0,0 +1,233 @@
+"""Asynchronous calculation jobs evaluated in parallel on a process pool.
+
+A job splits the rows of a stored dataset into shards of ``SHARD_ROWS``.
+Each shard is evaluated in a worker process, which memory-maps the dataset
+itself, so only row ranges and result arrays cross process boundaries.
+Shard results are merged in order into a ``CalculationResult``, and the
+compliant/non-compliant counts are summed as shards finish so progress can
+be polled. Cancelling a job drops its queued shards. A finished job keeps
+only the id of its result, which is handed to the result cache.
+
+``JobRegistry`` holds the jobs of a kind by id and forgets the oldest
+finished ones beyond ``MAX_FINISHED_JOBS``.
+"""
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Optional, Protocol, Tuple
+
+import numpy as np
+
+from dataset_store import META_FILE, Dataset, TableView
+from formula_engine import CompiledFormula, compile_formula
+from results import CalculationResult, evaluate_formula
+
+POOL_WORKERS = int(os.environ.get("FORMULA_BUILDER_WORKERS", os.cpu_count() or 1))
+SHARD_ROWS = int(os.environ.get("FORMULA_BUILDER_SHARD_ROWS", 250_000))
+MAX_FINISHED_JOBS = int(os.environ.get("FORMULA_BUILDER_MAX_JOBS", 256))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shared worker pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: the API process runs threads
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# Worker-side caches, so a worker compiles each formula and opens each dataset once
+@functools.lru_cache(maxsize=32)
+def _worker_formula(formula_string: str) -> CompiledFormula:
+    return compile_formula(formula_string)
+
+
+@functools.lru_cache(maxsize=8)
+def _worker_dataset(path: str, version: int) -> Dataset:
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    return Dataset(path, meta, version)
+
+
+def evaluate_shard(path: str, version: int, formula_string: str,
+                   row_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Evaluate a formula over some rows of a dataset, in a worker process.
+
+    Returns the calculated values, the missing-input mask and the number of
+    compliant rows.
+    """
+    dataset = _worker_dataset(path, version)
+    shard = TableView(dataset, row_ids)
+    calculated, missing = evaluate_formula(_worker_formula(formula_string), shard)
+    compliant = int((calculated <= shard.column("Regulatory Limit")).sum())
+    return calculated, missing, compliant
+
+
+class CalculationJob:
+    """A formula evaluated over a dataset in parallel shards."""
+
+    def __init__(self, dataset: Dataset, formula_id: str, formula: Dict,
+                 row_ids: Optional[np.ndarray] = None, shard_rows: int = SHARD_ROWS):
+        self.id = uuid.uuid4().hex[:12]
+        self.dataset = dataset
+        self.formula_id = formula_id
+        self.formula = formula
+        self.row_ids = row_ids  # None means every row
+        self.total_rows = len(dataset) if row_ids is None else len(row_ids)
+        self.shard_rows = max(shard_rows, 1)
+        self.shards_total = max(-(-self.total_rows // self.shard_rows), 1)
+        self.shards_done = 0
+        self.rows_processed = 0
+        self.compliant_count = 0
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.calculation_id: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self._cancelled = threading.Event()
+        self._futures = []
+        self._lock = threading.Lock()  # Orders submitting shards against cancelling
+
+    def _shard_rows(self, shard: int) -> np.ndarray:
+        start = shard * self.shard_rows
+        stop = min(start + self.shard_rows, self.total_rows)
+        if self.row_ids is None:
+            return np.arange(start, stop)
+        return self.row_ids[start:stop]
+
+    def run(self, on_complete: Optional[Callable[[CalculationResult], None]] = None) -> None:
+        """Evaluate every shard; the result is passed to ``on_complete``, which should keep it."""
+        try:
+            with self._lock:
+                if self._cancelled.is_set():
+                    return
+                self.status = "running"
+                pool = get_pool()
+                self._futures = [
+                    pool.submit(evaluate_shard, self.dataset.path, self.dataset.version,
+                                self.formula["formula_string"], self._shard_rows(shard))
+                    for shard in range(self.shards_total)
+                ]
+            shard_of = {future: shard for shard, future in enumerate(self._futures)}
+            calculated = [None] * self.shards_total
+            missing = [None] * self.shards_total
+            for future in as_completed(self._futures):
+                if self._cancelled.is_set():
+                    break
+                shard = shard_of[future]
+                calculated[shard], missing[shard], compliant = future.result()
+                self.shards_done += 1
+                self.rows_processed += len(calculated[shard])
+                self.compliant_count += compliant
+
+            if self._cancelled.is_set():
+                self.status = "cancelled"
+                return
+
+            table = self.dataset if self.row_ids is None else TableView(self.dataset, self.row_ids)
+            result = CalculationResult(table, self.formula_id, self.formula,
+                                       calculated=np.concatenate(calculated),
+                                       missing_inputs=np.concatenate(missing))
+            self.calculation_id = result.id
+            if on_complete:
+                on_complete(result)
+            if not self._cancelled.is_set():
+                self.status = "completed"
+        except CancelledError:
+            self.status = "cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = datetime.now().isoformat()
+
+    def start(self, on_complete: Optional[Callable[[CalculationResult], None]] = None) -> None:
+        threading.Thread(target=self.run, args=(on_complete,), name=f"calculate-{self.id}", daemon=True).start()
+
+    def complete_from(self, result: CalculationResult) -> None:
+        """Finish immediately with an existing (cached) result."""
+        summary = result.summary()
+        self.calculation_id = result.id
+        self.shards_done = self.shards_total
+        self.rows_processed = summary["total_processed"]
+        self.compliant_count = summary["compliant_count"]
+        self.status = "completed"
+        self.finished_at = datetime.now().isoformat()
+
+    def cancel(self) -> bool:
+        """Stop a queued or running job; returns False if it already finished."""
+        with self._lock:
+            if self.status not in ("queued", "running"):
+                return False
+            self._cancelled.set()
+            for future in self._futures:
+                future.cancel()
+            self.status = "cancelled"
+            return True
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "dataset_id": self.dataset.id,
+            "version": self.dataset.version,
+            "formula_id": self.formula_id,
+            "formula_name": self.formula["name"],
+            "progress": round(self.shards_done / self.shards_total, 4),
+            "shards_total": self.shards_total,
+            "shards_done": self.shards_done,
+            "total_rows": self.total_rows,
+            "rows_processed": self.rows_processed,
+            "compliant_count": self.compliant_count,
+            "non_compliant_count": self.rows_processed - self.compliant_count,
+            "calculation_id": self.calculation_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class Job(Protocol):
+    id: str
+    finished_at: Optional[str]
+
+
+class JobRegistry:
+    """Background jobs by id, keeping at most ``max_finished`` finished jobs (the newest)."""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self.jobs[job.id] = job
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+            for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
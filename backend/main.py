@@ -1,16 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import Depends, FastAPI, Request, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
 import json
+import logging
 import os
 from datetime import datetime
 
+from dataset_store import (Dataset, DatasetBusyError, DatasetStore, DatasetWriter, InMemoryTable, Table, TableView,
+                           normalize_frame)
+from export import MEDIA_TYPES, ExportError, check_format, stream_export
+from formula_engine import CompiledFormula, FormulaBatch, FormulaError, compile_formula
+from ingest import IngestError, IngestJob, ingest_file, spool_upload
+from jobs import CalculationJob, JobRegistry, shutdown_pool
+from metrics import MetricsRegistry, Timings, activate, count_rows, deactivate, stage
+from query import QueryError, distinct_values, filter_rows, query_rows
+from result_cache import ResultCache, cache_key
+from results import CalculationResult
+from rollups import CalculationHistory, ReportError
+from scenarios import calculate_batch, compare, comparison_rows
+from schema import VARIABLE_ALIASES
+
 app = FastAPI(title="Formula Builder API",
              description="API for drug pricing calculations and formula management",
              version="1.0.0")
 
+logger = logging.getLogger("formula_builder")
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -18,13 +39,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 # Data storage (in-memory for development)
 formulas = {}
-calculation_history = []
-uploaded_data = []  # Store uploaded data
-data_validation_summary = {}  # Store validation summary
+compiled_formulas: Dict[str, CompiledFormula] = {}  # formula_id -> parsed and validated formula
+dataset_store = DatasetStore()  # Uploaded datasets, reopened from disk on startup
+upload_jobs = JobRegistry()  # job_id -> background upload, forgetting the oldest finished
+result_cache = ResultCache()  # Calculation results, by cache key and by calculation id
+# Calculations by time, with pre-aggregated rollups for reports
+calculation_history = CalculationHistory(result_cache.get_by_id)
+calculation_jobs = JobRegistry()  # job_id -> background calculation; results live in result_cache
+request_metrics = MetricsRegistry()  # Request counts and stage timings per endpoint
+
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    """Collect the stage timings of a request, return them in a Server-Timing header and record them"""
+    timings = Timings()
+    token = activate(timings)
+    try:
+        response = await call_next(request)
+    finally:
+        deactivate(token)
+    route = request.scope.get("route")
+    request_metrics.record(f"{request.method} {route.path if route is not None else '(unmatched)'}", timings)
+    response.headers["Server-Timing"] = timings.server_timing()
+    return response
 
 class Formula(BaseModel):
     name: str
@@ -41,256 +82,727 @@ class Formula(BaseModel):
             }
         }
 
+class Correction(BaseModel):
+    column: str  # Internal or uploaded column name, e.g. "Discount Amount (USD)"
+    value: Optional[Union[float, str]] = None
+    row: Optional[int] = None  # Row number in the dataset, or
+    transaction_id: Optional[str] = None  # every row with this Transaction ID
+
+class CorrectionRequest(BaseModel):
+    corrections: List[Correction]
+
 class CalculationRequest(BaseModel):
     formula_id: str
-    data: List[Dict]
+    data: Optional[List[Dict]] = None  # Rows to calculate over; omit to use a stored dataset
+    dataset_id: Optional[str] = None  # Defaults to the most recent upload
+    version: Optional[int] = None
+    filters: Optional[Dict] = None  # Same filters as the row endpoints, e.g. {"product": "A"}
+    include_results: bool = True
+    layout: str = "rows"  # "columns" returns one list per column instead of one object per row
+
+class BatchCalculationRequest(BaseModel):
+    formula_ids: List[str]  # The first formula is the baseline for summary deltas
+    dataset_id: Optional[str] = None  # Defaults to the most recent upload
+    version: Optional[int] = None
+    filters: Optional[Dict] = None
+    include_results: bool = True
+    offset: int = 0
+    limit: Optional[int] = 100  # Rows of comparison results returned; None returns every row
+
+class CalculationJobRequest(BaseModel):
+    formula_id: str
+    dataset_id: Optional[str] = None  # Defaults to the most recent upload
+    version: Optional[int] = None
     filters: Optional[Dict] = None
 
+class RowQuery(BaseModel):
+    """Filter, sort and pagination query parameters for the row endpoints"""
+    product: Optional[str] = None
+    customer: Optional[str] = None
+    manufacturer: Optional[str] = None
+    transaction_type: Optional[str] = None
+    date: Optional[str] = None
+    status: Optional[str] = None
+    compliance_status: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    sort_by: Optional[str] = None
+    sort_order: str = "asc"
+    offset: int = 0
+    limit: Optional[int] = None
+    layout: str = "rows"  # "columns" returns one list per column instead of one object per row
+
+    def filters(self) -> Dict[str, Optional[str]]:
+        return self.model_dump(exclude={"start_date", "end_date", "sort_by", "sort_order", "offset", "limit", "layout"})
+
+def page_rows(table, query: RowQuery) -> Tuple[np.ndarray, int]:
+    """Row ids of the requested page of a table, and the total number of matches"""
+    count_rows(len(table))
+    try:
+        with stage("filter"):
+            return query_rows(table, query.filters(), query.start_date, query.end_date,
+                              sort_by=query.sort_by, descending=query.sort_order.lower() == "desc",
+                              offset=query.offset, limit=query.limit)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_layout(layout: str) -> bool:
+    """Whether a row endpoint should return columns rather than rows"""
+    if layout not in ("rows", "columns"):
+        raise HTTPException(status_code=400, detail="layout must be 'rows' or 'columns'")
+    return layout == "columns"
+
+def json_response(content: Dict) -> JSONResponse:
+    """Encode a response carrying rows here rather than in FastAPI, so it is timed as the serialize stage"""
+    with stage("serialize"):
+        return JSONResponse(jsonable_encoder(content))
+
+def export_rows(table, query: RowQuery):
+    """Row ids to export; a range when no filter or sort applies, so nothing is materialized"""
+    if any(query.filters().values()) or query.start_date or query.end_date or query.sort_by:
+        return page_rows(table, query)[0]
+    if query.offset < 0 or (query.limit is not None and query.limit < 0):
+        raise HTTPException(status_code=400, detail="offset and limit must not be negative")
+    stop = len(table) if query.limit is None else min(query.offset + query.limit, len(table))
+    return range(min(query.offset, stop), stop)
+
+def export_response(source, row_ids, export_format: str, filename: str,
+                    formula: Optional[str] = None) -> StreamingResponse:
+    """Stream rows of a table or calculation result as a file download"""
+    try:
+        export_format = check_format(export_format)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    extension = "arrows" if export_format == "arrow" else export_format
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{extension}"',
+               "X-Total-Rows": str(len(row_ids))}
+    if formula is not None:
+        headers["X-Formula-Used"] = formula.encode("ascii", "backslashreplace").decode()
+    return StreamingResponse(stream_export(source, row_ids, export_format),
+                             media_type=MEDIA_TYPES[export_format], headers=headers)
+
+@app.on_event("shutdown")
+def stop_workers():
+    shutdown_pool()
+
 @app.get("/")
 async def root():
     return {"message": "Formula Builder API is running"}
 
-@app.get("/api/data")
-async def get_uploaded_data():
-    """Retrieve the currently uploaded data"""
+def get_dataset(dataset_id: Optional[str] = None, version: Optional[int] = None) -> Optional[Dataset]:
+    """Look up a stored dataset, defaulting to the most recent upload
+
+    Without ``dataset_id``, ``version`` selects a version of the most recent upload.
+    """
+    if dataset_id is None:
+        latest = dataset_store.latest()
+        if latest is None or version is None:
+            return latest
+        dataset_id = latest.id
+    try:
+        return dataset_store.get(dataset_id, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+@app.get("/api/datasets")
+async def list_datasets():
+    return {"datasets": dataset_store.list()}
+
+def correction_rows(dataset: Dataset, correction: Correction) -> np.ndarray:
+    """Row ids a correction applies to"""
+    if correction.row is not None:
+        if not 0 <= correction.row < len(dataset):
+            raise HTTPException(status_code=400, detail=f"Row {correction.row} is out of range")
+        return np.array([correction.row])
+    if correction.transaction_id is not None:
+        rows = dataset.find("Transaction ID", correction.transaction_id)
+        if not len(rows):
+            raise HTTPException(status_code=404, detail=f"Transaction {correction.transaction_id} not found")
+        return rows
+    raise HTTPException(status_code=400, detail="Each correction needs a row or a transaction_id")
+
+@app.post("/api/datasets/{dataset_id}/corrections")
+async def correct_dataset(dataset_id: str, request: CorrectionRequest):
+    """Correct values of existing rows, recorded as a new version of the dataset"""
+    dataset = get_dataset(dataset_id)
+    if not request.corrections:
+        raise HTTPException(status_code=400, detail="No corrections given")
+    
+    # Group corrections by column so each column is rewritten once
+    updates: Dict[str, Tuple[List[np.ndarray], List]] = {}
+    for correction in request.corrections:
+        column = VARIABLE_ALIASES.get(correction.column.strip().lower())
+        if column is None:
+            raise HTTPException(status_code=400, detail=f"Unknown column: {correction.column}")
+        rows = correction_rows(dataset, correction)
+        row_lists, values = updates.setdefault(column, ([], []))
+        row_lists.append(rows)
+        values.extend([correction.value] * len(rows))
+    
+    writer = open_writer(dataset.meta.get("filename"), dataset_id)
+    try:
+        for column, (row_lists, values) in updates.items():
+            normalized = normalize_frame(pd.DataFrame({column: pd.Series(values, dtype=object)}))[column]
+            await run_in_threadpool(writer.correct, column, np.concatenate(row_lists), normalized)
+        corrected = writer.commit()
+    except Exception:
+        writer.abort()
+        raise
     return {
-        "data": uploaded_data,
-        "validation_summary": data_validation_summary
+        "dataset_id": corrected.id,
+        "version": corrected.version,
+        "rows_corrected": {column: int(sum(len(rows) for rows in row_lists))
+                           for column, (row_lists, values) in updates.items()}
     }
 
+@app.get("/api/data")
+async def get_uploaded_data(dataset_id: Optional[str] = None, version: Optional[int] = None,
+                            query: RowQuery = Depends()):
+    """Retrieve the currently uploaded data, optionally filtered, sorted and paged"""
+    columns = check_layout(query.layout)
+    dataset = get_dataset(dataset_id, version)
+    if dataset is None:
+        return {"data": [], "total": 0, "validation_summary": {}}
+    row_ids, total = page_rows(dataset, query)
+    response = {
+        "dataset_id": dataset.id,
+        "version": dataset.version,
+        "total": total,
+        "offset": query.offset,
+        "limit": query.limit,
+        "validation_summary": dataset.validation_summary
+    }
+    with stage("serialize"):
+        if columns:
+            response["columns"] = dataset.to_columns(row_ids)
+        else:
+            response["data"] = dataset.to_rows(row_ids)
+    return json_response(response)
+
+@app.get("/api/data/export")
+async def export_data(format: str = "csv", dataset_id: Optional[str] = None, version: Optional[int] = None,
+                      query: RowQuery = Depends()):
+    """Stream the uploaded data, optionally filtered and sorted, as CSV, NDJSON or Arrow"""
+    dataset = get_dataset(dataset_id, version)
+    if dataset is None:
+        raise HTTPException(status_code=400, detail="No data has been uploaded")
+    return export_response(dataset, export_rows(dataset, query), format, f"dataset-{dataset.id}-v{dataset.version}")
+
+@app.get("/api/data/values")
+async def get_column_values(columns: str = "product", dataset_id: Optional[str] = None,
+                            version: Optional[int] = None):
+    """Distinct values of filter columns (comma-separated filter names), e.g. for filter dropdowns"""
+    dataset = get_dataset(dataset_id, version)
+    if dataset is None:
+        return {"values": {}}
+    params = [param.strip() for param in columns.split(",") if param.strip()]
+    try:
+        values = distinct_values(dataset, params)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"dataset_id": dataset.id, "version": dataset.version, "values": values}
+
+def open_writer(filename: str, append_to: Optional[str] = None) -> DatasetWriter:
+    """A writer for a new dataset, or one appending to dataset ``append_to``"""
+    if append_to is None:
+        return dataset_store.create(filename)
+    try:
+        return dataset_store.open(append_to)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except DatasetBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), append_to: Optional[str] = None, include_data: bool = True):
+    """Upload a file as a new dataset, or append its rows to dataset ``append_to`` as a new version
+
+    Set ``include_data=false`` to leave the uploaded rows out of the response.
+    """
     if not file.filename.endswith(('.csv', '.xls', '.xlsx')):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV, XLS, or XLSX file.")
     
+    with stage("read"):
+        path = await spool_upload(file)
     try:
-        print(f"Processing file: {file.filename}")
-        contents = await file.read()
-        print(f"File size: {len(contents)} bytes")
-        
-        try:
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(pd.io.common.BytesIO(contents))
-            else:
-                df = pd.read_excel(pd.io.common.BytesIO(contents))
-            
-            print(f"DataFrame shape: {df.shape}")
-            print(f"Columns found: {df.columns.tolist()}")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
-        
-        # Define all possible columns and their mappings
-        all_possible_columns = {
-            'Transaction ID': 'Transaction ID',
-            'Drug Name': 'Product',
-            'Sale Price (USD)': 'Sale Price',
-            'Discount Amount (USD)': 'Discount Amount',
-            'Chargeback Amount (USD)': 'Chargeback Amount',
-            'Rebate Amount (USD)': 'Rebate Amount',
-            'Admin Fees (USD)': 'Admin Fees',
-            'Free Goods Adjustments': 'Free Goods Adjustments',
-            'Units Sold': 'Units Sold',
-            'Exclusion Flag': 'Exclusion Flag',
-            'Manufacturer': 'Manufacturer',
-            'Sales Year': 'Date',
-            'Total Sales (USD)': 'Price',
-            'Discount Percentage (%)': 'Discount',
-            'Customer Category': 'Customer',
-            'Sales Region': 'Transaction Type',
-            'Regulatory Price Limit (USD)': 'Regulatory Limit',
-            'Pricing Compliance Status': 'Status',
-            'Number of Free Goods': 'Free Goods',
-            'Volume Tier Discount (USD)': 'Volume Discount',
-            'Competitor Price (USD)': 'Competitor Price',
-            'Profit Margin (%)': 'Profit Margin',
-            'Market Segment': 'Market Segment'
-        }
-        
-        # Create a mapping for the columns that exist in the uploaded file
-        column_mapping = {col: all_possible_columns[col] for col in df.columns if col in all_possible_columns}
+        logger.info("Processing file %s (%d bytes)", file.filename, os.path.getsize(path))
         
-        # Minimum required columns for basic functionality
-        minimum_required_columns = [
-            'Drug Name',
-            'Total Sales (USD)',
-            'Discount Percentage (%)'
-        ]
+        # Parse in a worker thread so other requests are served meanwhile
+        writer = open_writer(file.filename, append_to)
+        dataset = await run_in_threadpool(ingest_file, path, file.filename, writer)
         
-        missing_columns = [col for col in minimum_required_columns if col not in df.columns]
-        if missing_columns:
-            available_columns = df.columns.tolist()
-            error_message = (
-                f"Missing minimum required columns: {', '.join(missing_columns)}\n"
-                f"Available columns in file: {', '.join(available_columns)}"
-            )
-            raise HTTPException(status_code=400, detail=error_message)
-        
-        # Rename existing columns to match frontend expectations
-        df = df.rename(columns=column_mapping)
-        
-        # Perform data validation
-        validation_summary = {
-            "missing_discounts": len(df[df["Discount"].isna()]) if "Discount" in df.columns else 0,
-            "govt_transactions": len(df[df["Customer"] == "Government"]) if "Customer" in df.columns else 0,
-            "duplicate_transactions": len(df[df.duplicated()]),
-            "total_columns": len(df.columns),
-            "available_columns": df.columns.tolist()
-        }
-        
-        # Process the data to match frontend structure
-        processed_data = []
-        for _, row in df.iterrows():
-            try:
-                # Create a base dictionary with None/0 values for all possible fields
-                processed_row = {
-                    mapped_name: None for mapped_name in all_possible_columns.values()
-                }
-                
-                # Update with actual values from the row
-                for original_col, mapped_col in column_mapping.items():
-                    value = row[mapped_col]
-                    
-                    # Handle different data types
-                    if pd.isna(value):
-                        if mapped_col in ['Price', 'Discount Amount', 'Regulatory Limit', 'Sale Price',
-                                        'Chargeback Amount', 'Rebate Amount', 'Admin Fees', 'Volume Discount',
-                                        'Competitor Price']:
-                            processed_row[mapped_col] = 0.0
-                        elif mapped_col in ['Units Sold', 'Free Goods']:
-                            processed_row[mapped_col] = 0
-                        elif mapped_col in ['Discount', 'Profit Margin']:
-                            processed_row[mapped_col] = "--"
-                        else:
-                            processed_row[mapped_col] = None
-                    else:
-                        # Convert numeric values
-                        if mapped_col in ['Price', 'Discount Amount', 'Regulatory Limit', 'Sale Price',
-                                        'Chargeback Amount', 'Rebate Amount', 'Admin Fees', 'Volume Discount',
-                                        'Competitor Price']:
-                            processed_row[mapped_col] = float(value) if pd.notnull(value) else 0.0
-                        elif mapped_col in ['Units Sold', 'Free Goods']:
-                            processed_row[mapped_col] = int(value) if pd.notnull(value) else 0
-                        else:
-                            processed_row[mapped_col] = str(value)
-                
-                processed_data.append(processed_row)
-            except Exception as e:
-                print(f"Error processing row: {row}")
-                print(f"Error details: {str(e)}")
-                continue
-        
-        if not processed_data:
-            raise HTTPException(status_code=400, detail="No valid data could be processed from the file")
-        
-        # Store the processed data and validation summary
-        global uploaded_data, data_validation_summary
-        uploaded_data = processed_data
-        data_validation_summary = validation_summary
-        
-        print(f"Successfully processed {len(processed_data)} rows")
-        return {
+        logger.info("Processed %d rows of %s", len(dataset), file.filename)
+        response = {
             "message": "File processed successfully",
-            "rows": len(processed_data),
-            "data": processed_data,
-            "validation_summary": validation_summary
+            "dataset_id": dataset.id,
+            "version": dataset.version,
+            "rows": len(dataset),
+            "validation_summary": dataset.validation_summary
         }
+        if include_data:
+            with stage("serialize"):
+                response["data"] = dataset.to_rows()
+        return json_response(response)
     
     except HTTPException:
         raise
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Error processing %s", file.filename)
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        os.remove(path)
+
+@app.post("/api/upload/jobs")
+async def create_upload_job(file: UploadFile = File(...), append_to: Optional[str] = None):
+    """Start ingesting a file in the background and return a job to poll"""
+    if not file.filename.endswith(('.csv', '.xls', '.xlsx')):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV, XLS, or XLSX file.")
+    
+    writer = open_writer(file.filename, append_to)
+    try:
+        with stage("read"):
+            path = await spool_upload(file)
+    except Exception:
+        writer.abort()
+        raise
+    job = IngestJob(path, file.filename, writer)
+    upload_jobs.add(job)
+    job.start()
+    return job.to_dict()
+
+@app.get("/api/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job.to_dict()
+
+def get_compiled_formula(formula_id: str) -> CompiledFormula:
+    """Return the cached compiled plan for a stored formula, compiling it if needed"""
+    if formula_id not in compiled_formulas:
+        try:
+            compiled_formulas[formula_id] = compile_formula(formulas[formula_id]["formula_string"])
+        except FormulaError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid formula: {str(e)}")
+    return compiled_formulas[formula_id]
 
 @app.post("/api/formulas")
 async def create_formula(formula: Formula):
+    try:
+        with stage("parse"):
+            compiled = compile_formula(formula.formula_string)
+    except FormulaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid formula: {str(e)}")
+    
     formula_id = str(len(formulas) + 1)
     formula.created_at = datetime.now().isoformat()
     formula_dict = formula.model_dump()
+    formula_dict["variables"] = sorted(compiled.columns)
     formulas[formula_id] = formula_dict
+    compiled_formulas[formula_id] = compiled
     return {"id": formula_id, **formula_dict}
 
+@app.put("/api/formulas/{formula_id}")
+async def update_formula(formula_id: str, formula: Formula):
+    """Edit a formula; cached results of other formulas are unaffected"""
+    if formula_id not in formulas:
+        raise HTTPException(status_code=404, detail="Formula not found")
+    try:
+        with stage("parse"):
+            compiled = compile_formula(formula.formula_string)
+    except FormulaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid formula: {str(e)}")
+    
+    previous = formulas[formula_id]
+    formula.created_at = previous["created_at"]
+    formula_dict = formula.model_dump()
+    formula_dict["variables"] = sorted(compiled.columns)
+    formula_dict["updated_at"] = datetime.now().isoformat()
+    # Results are cached by expression, so a rename or a change that
+    # normalizes to the same expression is not recalculated
+    expression_changed = compiled.expression != get_compiled_formula(formula_id).expression
+    formulas[formula_id] = formula_dict
+    compiled_formulas[formula_id] = compiled
+    return {"id": formula_id, **formula_dict, "expression_changed": expression_changed}
+
 @app.get("/api/formulas")
 async def get_formulas():
     return formulas
 
+def filtered_table(table: Table, filters: Optional[Dict]) -> Table:
+    """Restrict a table to the rows matching calculation request filters"""
+    if not filters:
+        return table
+    filters = dict(filters)
+    start_date, end_date = filters.pop("start_date", None), filters.pop("end_date", None)
+    try:
+        with stage("filter"):
+            row_ids = filter_rows(table, filters, start_date, end_date)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return table if row_ids is None else TableView(table, row_ids)
+
+def record_calculation(result: CalculationResult, dataset: Optional[Dataset] = None,
+                       updates: Optional[CalculationResult] = None):
+    """Store a calculation in history, or update the entry of the result it ``updates``"""
+    summary = result.summary()
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "calculation_id": result.id,
+        "formula_id": result.formula_id,
+        "formula_name": result.formula["name"],
+        "dataset_id": dataset.id if dataset is not None else None,
+        "version": dataset.version if dataset is not None else None,
+        "rows_processed": summary["total_processed"],
+        "rows_computed": summary["rows_computed"],
+        "compliant_count": summary["compliant_count"],
+        "non_compliant_count": summary["non_compliant_count"]
+    }
+    with stage("aggregate"):
+        calculation_history.record(entry, result, updates=updates)
+
+def update_cached_result(key: tuple, dataset: Dataset, table: Table, compiled: CompiledFormula,
+                         formula_id: str, formula: Dict) -> Tuple[Optional[CalculationResult], Optional[CalculationResult]]:
+    """Bring a cached result from an earlier version of the dataset up to date
+
+    Returns the updated result and the result it was updated from, or
+    (None, None) if there is nothing to update incrementally.
+    """
+    previous = result_cache.latest_before(key)
+    if previous is None:
+        return None, None
+    version, base = previous
+    result = base.updated(table, compiled, dataset.changes_since(version))
+    if result is None:
+        return None, None
+    return result.with_formula(formula_id, formula), base
+
 @app.post("/api/calculate")
 async def calculate_prices(request: CalculationRequest):
     if request.formula_id not in formulas:
         raise HTTPException(status_code=404, detail="Formula not found")
     
-    try:
-        # Get the formula
-        formula = formulas[request.formula_id]
-        formula_string = formula["formula_string"]
-        
-        # Process each row with the formula
-        results = []
-        for row in request.data:
-            try:
-                # Extract values needed for calculation
-                total_sales = float(row["Price"]) if row["Price"] else 0.0  # Total Sales (USD)
-                discount_percentage = float(row["Discount"]) if row["Discount"] != "--" else 0.0
-                regulatory_limit = float(row["Regulatory Limit"]) if row["Regulatory Limit"] else 0.0
-                
-                # Calculate effective price using the formula
-                effective_price = total_sales * (1 - (discount_percentage / 100))
-                
-                # Determine compliance status
-                compliance_status = "Compliant" if effective_price <= regulatory_limit else "Non-Compliant"
-                
-                # Create result row with all original data plus calculations
-                result_row = {
-                    "Product": row["Product"],
-                    "Price": total_sales,
-                    "Calculated Price": effective_price,
-                    "Regulatory Limit": regulatory_limit,
-                    "Discount": row["Discount"],
-                    "Compliance Status": compliance_status,
-                    "Formula Used": formula_string
-                }
-                results.append(result_row)
-                print(f"Processed row: {result_row}")  # Debug log
-            except Exception as e:
-                print(f"Error processing row: {row}")
-                print(f"Error details: {str(e)}")
-                continue
-        
-        if not results:
+    formula = formulas[request.formula_id]
+    compiled = get_compiled_formula(request.formula_id)
+    columns = check_layout(request.layout)
+    
+    result = None
+    dataset = None
+    base = None
+    if request.data is not None:
+        if not request.data:
             raise HTTPException(status_code=400, detail="No calculations could be performed")
+        key = None
+    else:
+        # Calculate over a stored dataset, reusing a cached result when nothing has changed
+        dataset = get_dataset(request.dataset_id, request.version)
+        if dataset is None:
+            raise HTTPException(status_code=400, detail="No data has been uploaded")
+        key = cache_key(dataset.id, dataset.version, compiled.expression, request.filters)
+        result = result_cache.get(key)
+        if result is not None:
+            result = result.with_formula(request.formula_id, formula)
+    cache_hit = result is not None
+    
+    if result is None:
+        try:
+            # Evaluate the formula over whole columns at once
+            if dataset is None:
+                table = InMemoryTable.from_frame(pd.DataFrame(request.data))
+            else:
+                table = dataset
+            table = filtered_table(table, request.filters)
+            # Evaluate in a worker thread so other requests are served meanwhile
+            with stage("compute"):
+                if key is not None:
+                    # Only evaluate rows appended or corrected since a cached earlier version
+                    result, base = await run_in_threadpool(update_cached_result, key, dataset, table, compiled,
+                                                           request.formula_id, formula)
+                if result is None:
+                    result = await run_in_threadpool(CalculationResult, table, request.formula_id, formula, compiled)
+        except HTTPException:
+            raise
+        except FormulaError as e:
+            raise HTTPException(status_code=400, detail=f"Error performing calculations: {str(e)}")
+        except Exception as e:
+            logger.exception("Calculation error")
+            raise HTTPException(status_code=500, detail=f"Error performing calculations: {str(e)}")
         
-        # Store calculation in history
-        calculation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "formula_id": request.formula_id,
-            "formula_name": formula["name"],
-            "rows_processed": len(results),
-            "compliant_count": sum(1 for r in results if r["Compliance Status"] == "Compliant"),
-            "non_compliant_count": sum(1 for r in results if r["Compliance Status"] == "Non-Compliant")
-        })
-        
-        return {
-            "results": results,
-            "summary": {
-                "total_processed": len(results),
-                "compliant_count": sum(1 for r in results if r["Compliance Status"] == "Compliant"),
-                "non_compliant_count": sum(1 for r in results if r["Compliance Status"] == "Non-Compliant"),
-                "formula_used": formula_string,
-                "formula_name": formula["name"]
-            }
-        }
+        # Keep the result so it can be filtered and paged without recalculating
+        result_cache.put(key if key is not None else result.id, result)
     
-    except Exception as e:
-        print(f"Calculation error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error performing calculations: {str(e)}")
+    # Aggregating a new result for reports reads every row, so do it off the event loop
+    await run_in_threadpool(record_calculation, result, dataset, base)
+    count_rows(result.num_rows)
+    summary = result.summary()
+    cache_stats = result_cache.stats()
+    summary["cache"] = {"hit": cache_hit, "hits": cache_stats["hits"], "misses": cache_stats["misses"]}
+    response = {
+        "calculation_id": result.id,
+        "summary": summary
+    }
+    if dataset is not None:
+        response["dataset_id"] = dataset.id
+        response["version"] = dataset.version
+    with stage("serialize"):
+        if request.include_results and columns:
+            response["formula_used"] = formula["formula_string"]
+            response["columns"] = result.to_columns()
+        elif request.include_results:
+            response["results"] = result.to_rows()
+    return json_response(response)
+
+@app.post("/api/calculate/batch")
+async def calculate_batch_prices(request: BatchCalculationRequest):
+    """Calculate several formulas over a stored dataset in one pass and compare them side by side"""
+    formula_ids = list(dict.fromkeys(request.formula_ids))
+    if not formula_ids:
+        raise HTTPException(status_code=400, detail="No formulas given")
+    for formula_id in formula_ids:
+        if formula_id not in formulas:
+            raise HTTPException(status_code=404, detail=f"Formula {formula_id} not found")
+    compiled = {formula_id: get_compiled_formula(formula_id) for formula_id in formula_ids}
+    
+    dataset = get_dataset(request.dataset_id, request.version)
+    if dataset is None:
+        raise HTTPException(status_code=400, detail="No data has been uploaded")
+    table = filtered_table(dataset, request.filters)
+    
+    # Reuse cached and incrementally updatable results; evaluate the rest together
+    results: Dict[str, CalculationResult] = {}
+    cache_hits = set()
+    pending = []
+    for formula_id in formula_ids:
+        key = cache_key(dataset.id, dataset.version, compiled[formula_id].expression, request.filters)
+        cached = result_cache.get(key)
+        if cached is not None:
+            results[formula_id] = cached.with_formula(formula_id, formulas[formula_id])
+            cache_hits.add(formula_id)
+            record_calculation(results[formula_id], dataset)
+            continue
+        with stage("compute"):
+            result, base = await run_in_threadpool(update_cached_result, key, dataset, table, compiled[formula_id],
+                                                   formula_id, formulas[formula_id])
+        if result is not None:
+            results[formula_id] = result
+            result_cache.put(key, result)
+            await run_in_threadpool(record_calculation, result, dataset, base)
+        else:
+            pending.append((key, formula_id))
+    
+    if pending:
+        try:
+            with stage("compute"):
+                computed = await run_in_threadpool(
+                    calculate_batch, table,
+                    [(formula_id, formulas[formula_id], compiled[formula_id]) for _, formula_id in pending])
+        except FormulaError as e:
+            raise HTTPException(status_code=400, detail=f"Error performing calculations: {str(e)}")
+        for (key, formula_id), result in zip(pending, computed):
+            results[formula_id] = result
+            result_cache.put(key, result)
+            await run_in_threadpool(record_calculation, result, dataset)
+    
+    ordered = [results[formula_id] for formula_id in formula_ids]
+    count_rows(len(table) * len(ordered))
+    shared = FormulaBatch([compiled[formula_id] for formula_id in formula_ids]).shared
+    response = {
+        "dataset_id": dataset.id,
+        "version": dataset.version,
+        "formulas": [{
+            "formula_id": result.formula_id,
+            "formula_name": result.formula["name"],
+            "calculation_id": result.id,
+            "cache_hit": result.formula_id in cache_hits,
+            "summary": result.summary()
+        } for result in ordered],
+        "shared_subexpressions": sorted(shared),
+        **compare(ordered)
+    }
+    if request.include_results:
+        try:
+            row_ids, total = query_rows(table, offset=request.offset, limit=request.limit)
+        except QueryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        with stage("serialize"):
+            response["results"] = comparison_rows(ordered, row_ids)
+        response["total"] = total
+        response["offset"] = request.offset
+        response["limit"] = request.limit
+    return json_response(response)
+
+def result_page(result: CalculationResult, query: RowQuery) -> Dict:
+    """A page of calculation results in the requested layout"""
+    columns = check_layout(query.layout)
+    row_ids, total = page_rows(result, query)
+    result_cache.resize(result.id)  # Filtering or sorting may have built an index
+    page = {}
+    with stage("serialize"):
+        if columns:
+            page["formula_used"] = result.formula["formula_string"]
+            page["columns"] = result.to_columns(row_ids)
+        else:
+            page["results"] = result.to_rows(row_ids)
+    return {
+        **page,
+        "total": total,
+        "offset": query.offset,
+        "limit": query.limit,
+        "summary": result.summary()
+    }
+
+@app.get("/api/calculations/{calculation_id}/results")
+async def get_calculation_results(calculation_id: str, query: RowQuery = Depends()):
+    """Retrieve a filtered, sorted page of a previous calculation's results"""
+    result = result_cache.get_by_id(calculation_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Calculation not found")
+    return json_response({"calculation_id": calculation_id, **result_page(result, query)})
+
+@app.get("/api/calculations/{calculation_id}/export")
+async def export_calculation_results(calculation_id: str, format: str = "csv", query: RowQuery = Depends()):
+    """Stream a previous calculation's results, optionally filtered and sorted, as CSV, NDJSON or Arrow"""
+    result = result_cache.get_by_id(calculation_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Calculation not found")
+    row_ids = export_rows(result, query)
+    result_cache.resize(calculation_id)
+    return export_response(result, row_ids, format, f"calculation-{calculation_id}",
+                           formula=result.formula["formula_string"])
+
+@app.post("/api/calculate/jobs")
+async def create_calculation_job(request: CalculationJobRequest):
+    """Start calculating over a stored dataset in parallel shards and return a job to poll"""
+    if request.formula_id not in formulas:
+        raise HTTPException(status_code=404, detail="Formula not found")
+    
+    formula = formulas[request.formula_id]
+    compiled = get_compiled_formula(request.formula_id)
+    dataset = get_dataset(request.dataset_id, request.version)
+    if dataset is None:
+        raise HTTPException(status_code=400, detail="No data has been uploaded")
+    
+    table = filtered_table(dataset, request.filters)
+    job = CalculationJob(dataset, request.formula_id, formula,
+                         row_ids=table.row_ids if isinstance(table, TableView) else None)
+    calculation_jobs.add(job)
+    
+    key = cache_key(dataset.id, dataset.version, compiled.expression, request.filters)
+    cached = result_cache.get(key)
+    if cached is not None:
+        cached = cached.with_formula(request.formula_id, formula)
+        job.complete_from(cached)
+        record_calculation(cached, dataset)
+        return job.to_dict()
+    
+    # Only rows appended or corrected since a cached earlier version need
+    # evaluating, which is done here rather than on the worker pool
+    result, base = await run_in_threadpool(update_cached_result, key, dataset, table, compiled,
+                                           request.formula_id, formula)
+    if result is not None:
+        result_cache.put(key, result)
+        job.complete_from(result)
+        await run_in_threadpool(record_calculation, result, dataset, base)
+    else:
+        def on_complete(result: CalculationResult):
+            result_cache.put(key, result)
+            record_calculation(result, dataset)
+        job.start(on_complete)
+    return job.to_dict()
+
+def get_calculation_job(job_id: str) -> CalculationJob:
+    job = calculation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Calculation job not found")
+    return job
+
+@app.get("/api/calculate/jobs/{job_id}")
+async def get_calculation_job_status(job_id: str):
+    return get_calculation_job(job_id).to_dict()
+
+@app.get("/api/calculate/jobs/{job_id}/results")
+async def get_calculation_job_results(job_id: str, query: RowQuery = Depends()):
+    """Retrieve a filtered, sorted page of a finished job's results"""
+    job = get_calculation_job(job_id)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Calculation job is {job.status}")
+    result = result_cache.get_by_id(job.calculation_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Results of this job are no longer cached; calculate it again")
+    result = result.with_formula(job.formula_id, job.formula)
+    return json_response({"job_id": job_id, "calculation_id": job.calculation_id, **result_page(result, query)})
+
+@app.post("/api/calculate/jobs/{job_id}/cancel")
+async def cancel_calculation_job(job_id: str):
+    job = get_calculation_job(job_id)
+    if not job.cancel():
+        raise HTTPException(status_code=409, detail=f"Calculation job is already {job.status}")
+    return job.to_dict()
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Request counts, throughput and stage timings per endpoint since startup"""
+    return {**request_metrics.snapshot(), "cache": result_cache.stats()}
 
 @app.get("/api/reports")
-async def get_reports(start_date: Optional[str] = None, end_date: Optional[str] = None):
+async def get_reports(start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      group_by: str = "product", formula_id: Optional[str] = None,
+                      calculation_id: Optional[str] = None):
+    """Calculations recorded between two dates, and a compliance rollup of the latest one
+
+    The rollup is grouped by ``group_by`` (comma-separated: product,
+    transaction_type, customer, date) and comes from the latest calculation
+    in the range, optionally of one formula, or from ``calculation_id``.
+    """
+    try:
+        calculations = calculation_history.between(start_date, end_date)
+    except ReportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if calculation_id is not None:
+        selected = next((c for c in reversed(calculations) if c["calculation_id"] == calculation_id), None)
+        if selected is None:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+    else:
+        selected = next((c for c in reversed(calculations) if formula_id in (None, c["formula_id"])), None)
+    
+    rollup = None
+    rollup_error = None
+    calculation_rollup = None
+    if selected is not None:
+        dimensions = [dimension.strip() for dimension in group_by.split(",") if dimension.strip()]
+        with stage("aggregate"):
+            calculation_rollup = await run_in_threadpool(calculation_history.rollup, selected["calculation_id"])
+        if calculation_rollup is None:
+            rollup_error = ("The rollup of this calculation was evicted and its results are no longer cached; "
+                            "calculate it again")
+    if calculation_rollup is not None:
+        try:
+            with stage("aggregate"):
+                groups = calculation_rollup.group(dimensions)
+        except ReportError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        rollup = {
+            "calculation_id": selected["calculation_id"],
+            "formula_id": selected["formula_id"],
+            "formula_name": selected["formula_name"],
+            "group_by": dimensions,
+            "groups": groups
+        }
     return {
-        "calculations": calculation_history,
+        "calculations": calculations,
         "summary": {
-            "total_calculations": len(calculation_history),
-            "latest_calculation": calculation_history[-1] if calculation_history else None
-        }
+            "total_calculations": len(calculations),
+            "latest_calculation": calculations[-1] if calculations else None
+        },
+        "rollup": rollup,
+        "rollup_error": rollup_error
     }
 
 if __name__ == "__main__":
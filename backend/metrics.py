@@ -0,0 +1,114 @@
+"""Per-stage request timing.
+
+Work is timed in named stages (read, parse, normalize, validate, store,
+filter, compute, aggregate, serialize) with ``stage(name)``. The timings
+of the current request live in a context variable, so code running in
+worker threads on behalf of the request adds to them too. Each request's
+timings are returned in a ``Server-Timing`` header and summed per endpoint
+in a ``MetricsRegistry`` for ``GET /api/metrics``. Background jobs keep
+their own ``Timings``.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+STAGES = ["read", "parse", "normalize", "validate", "store", "filter", "compute", "aggregate", "serialize"]
+
+_current: contextvars.ContextVar[Optional["Timings"]] = contextvars.ContextVar("timings", default=None)
+
+
+def _milliseconds(stages: Dict[str, float]) -> Dict[str, float]:
+    """Stage durations in milliseconds, in pipeline order."""
+    ordered = sorted(stages, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
+    return {name: round(stages[name] * 1000, 3) for name in ordered}
+
+
+class Timings:
+    """Seconds spent in each stage of one request or job."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.rows = 0  # rows handled, for throughput
+        self.started = time.perf_counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, float]:
+        return _milliseconds(self.stages)
+
+    def server_timing(self) -> str:
+        """The timings as a ``Server-Timing`` header value, in milliseconds."""
+        parts = [f"{name};dur={duration}" for name, duration in self.to_dict().items()]
+        parts.append(f"total;dur={round(self.elapsed * 1000, 3)}")
+        return ", ".join(parts)
+
+
+def activate(timings: Timings) -> contextvars.Token:
+    """Make ``timings`` collect the stages timed in this context."""
+    return _current.set(timings)
+
+
+def deactivate(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as part of stage ``name`` of the current request or job."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start)
+
+
+def count_rows(rows: int) -> None:
+    """Record that the current request or job handled ``rows`` rows."""
+    timings = _current.get()
+    if timings is not None:
+        timings.rows += rows
+
+
+class MetricsRegistry:
+    """Request counts and stage timings summed per endpoint."""
+
+    def __init__(self):
+        self.endpoints: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, timings: Timings) -> None:
+        elapsed = timings.elapsed
+        with self._lock:
+            entry = self.endpoints.setdefault(endpoint, {"requests": 0, "rows": 0, "total_seconds": 0.0,
+                                                         "max_seconds": 0.0, "stages": {}})
+            entry["requests"] += 1
+            entry["rows"] += timings.rows
+            entry["total_seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+            for name, seconds in timings.stages.items():
+                entry["stages"][name] = entry["stages"].get(name, 0.0) + seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            endpoints = {}
+            for endpoint, entry in self.endpoints.items():
+                endpoints[endpoint] = {
+                    "requests": entry["requests"],
+                    "rows": entry["rows"],
+                    "total_ms": round(entry["total_seconds"] * 1000, 3),
+                    "mean_ms": round(entry["total_seconds"] * 1000 / entry["requests"], 3),
+                    "max_ms": round(entry["max_seconds"] * 1000, 3),
+                    "rows_per_second": round(entry["rows"] / entry["total_seconds"], 1) if entry["total_seconds"] else None,
+                    "stages_ms": _milliseconds(entry["stages"]),
+                }
+            return {"endpoints": endpoints}
+
@@ -0,0 +1,219 @@
+"""Secondary indexes and server-side filtering, sorting and pagination.
+
+Text columns are dictionary-encoded, so an index over a column is a
+postings list: every row id ordered by dictionary code, plus the offset
+where each code's rows start. Filters are matched against the (small)
+dictionary first and only then expanded to row ids, so a substring filter
+on Product costs O(categories + matching rows) rather than a row scan.
+Date ranges work the same way by parsing each distinct date once.
+
+Query functions work on any table exposing ``num_rows``, ``index(name)``
+and ``sort_key(name, row_ids)``. Sorted rows are ordered by row id among
+equal values, with missing values last in either direction.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Query parameter -> (column, match mode)
+FILTER_COLUMNS = {
+    "product": ("Product", "contains"),
+    "customer": ("Customer", "contains"),
+    "manufacturer": ("Manufacturer", "contains"),
+    "transaction_type": ("Transaction Type", "contains"),
+    "date": ("Date", "contains"),
+    "status": ("Status", "exact"),
+    "compliance_status": ("Compliance Status", "exact"),
+}
+
+
+class QueryError(ValueError):
+    """Raised for filters or sort keys that cannot be applied."""
+
+
+def _row_dtype(num_rows: int) -> np.dtype:
+    return np.dtype("<i4") if num_rows < 2 ** 31 else np.dtype("<i8")
+
+
+class ColumnIndex:
+    """Row ids of a dictionary-encoded column grouped by code.
+
+    Rows with code ``c`` are ``postings[offsets[c + 1]:offsets[c + 2]]``;
+    missing values (code -1) come first. ``num_rows`` limits the index to a
+    prefix of the rows, for reading older dataset versions.
+    """
+
+    def __init__(self, postings: np.ndarray, offsets: np.ndarray, categories: np.ndarray,
+                 num_rows: Optional[int] = None):
+        self.postings = postings
+        self.offsets = offsets
+        self.categories = categories
+        self.num_rows = num_rows
+
+    @classmethod
+    def build(cls, codes: np.ndarray, categories: np.ndarray) -> "ColumnIndex":
+        postings = np.argsort(codes, kind="stable").astype(_row_dtype(len(codes)))
+        counts = np.bincount(np.asarray(codes, dtype=np.int64) + 1, minlength=len(categories) + 1)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(postings, offsets, categories)
+
+    def rows(self, codes) -> np.ndarray:
+        """Sorted row ids whose value is one of ``codes``."""
+        parts = [self.postings[self.offsets[code + 1]:self.offsets[code + 2]] for code in codes]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        rows = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+        if self.num_rows is not None:
+            rows = rows[:np.searchsorted(rows, self.num_rows)]
+        return np.asarray(rows, dtype=np.int64)
+
+    def present_codes(self) -> np.ndarray:
+        """Codes of the categories that occur in the indexed rows."""
+        starts, stops = self.offsets[1:-1], self.offsets[2:]
+        present = stops > starts
+        if self.num_rows is not None:
+            # A code's row ids are ascending, so its first one tells whether it occurs in the prefix
+            present[present] = self.postings[starts[present]] < self.num_rows
+        return np.flatnonzero(present)
+
+    def ordered_rows(self, start: int, stop: int, descending: bool = False) -> np.ndarray:
+        """Rows ``start:stop`` of the table ordered by this column's value.
+
+        Only reads the postings of the categories that overlap the page.
+        """
+        ranks = np.argsort(category_ranks(self.categories)[:-1])
+        order = ranks[::-1] if descending else ranks
+        # Missing values sort last either way
+        order = np.append(order, -1)
+        counts = np.diff(self.offsets)[order + 1]
+        ends = np.cumsum(counts)
+        first = np.searchsorted(ends, start, side="right")
+        parts = []
+        position = ends[first - 1] if first else 0
+        for code in order[first:]:
+            if position >= stop:
+                break
+            parts.append(self.postings[self.offsets[code + 1]:self.offsets[code + 2]])
+            position += len(parts[-1])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        skip = start - (ends[first - 1] if first else 0)
+        return np.asarray(np.concatenate(parts)[skip:skip + stop - start], dtype=np.int64)
+
+
+def category_ranks(categories: np.ndarray) -> np.ndarray:
+    """Alphabetical rank of each code, indexable by code with -1 ranked last."""
+    values = pd.Series(categories, dtype=object)
+    ranks = np.empty(len(values) + 1, dtype=np.int64)
+    ranks[:-1] = values.rank(method="dense", na_option="bottom").to_numpy(dtype=np.int64)
+    ranks[-1] = len(values) + 1
+    return ranks
+
+
+def match_codes(categories: np.ndarray, value: str, mode: str) -> List[int]:
+    """Codes of the categories matching a filter value, case-insensitively."""
+    lowered = pd.Series(categories, dtype=object).str.lower()
+    needle = value.strip().lower()
+    if mode == "exact":
+        matches = lowered == needle
+    else:
+        matches = lowered.str.contains(needle, regex=False)
+    return np.flatnonzero(matches.fillna(False).to_numpy(dtype=bool)).tolist()
+
+
+def match_date_range(categories: np.ndarray, start_date: Optional[str], end_date: Optional[str]) -> List[int]:
+    """Codes of the dates that fall within [start_date, end_date]."""
+    try:
+        start = pd.Timestamp(start_date) if start_date else None
+        end = pd.Timestamp(end_date) if end_date else None
+    except ValueError as e:
+        raise QueryError(f"Invalid date filter: {str(e)}")
+    dates = pd.to_datetime(pd.Series(categories, dtype=object), errors="coerce", format="mixed")
+    matches = dates.notna()
+    if start is not None:
+        matches &= dates >= start
+    if end is not None:
+        matches &= dates <= end
+    return np.flatnonzero(matches.to_numpy(dtype=bool)).tolist()
+
+
+def filter_rows(table, filters: Dict[str, str], start_date: Optional[str] = None,
+                end_date: Optional[str] = None) -> Optional[np.ndarray]:
+    """Sorted row ids matching every filter, or None when nothing is filtered."""
+    conditions = []
+    for param, value in filters.items():
+        if value is None or value == "":
+            continue
+        if param not in FILTER_COLUMNS:
+            raise QueryError(f"Unknown filter '{param}'")
+        column, mode = FILTER_COLUMNS[param]
+        conditions.append((column, lambda categories, value=value, mode=mode: match_codes(categories, value, mode)))
+    if start_date or end_date:
+        conditions.append(("Date", lambda categories: match_date_range(categories, start_date, end_date)))
+
+    rows = None
+    for column, matcher in conditions:
+        index = table.index(column)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        matched = index.rows(matcher(index.categories))
+        rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        if len(rows) == 0:
+            break
+    return rows
+
+
+def distinct_values(table, params: List[str]) -> Dict[str, list]:
+    """Sorted distinct values of the filter columns ``params``, read from their indexes."""
+    values = {}
+    for param in params:
+        if param not in FILTER_COLUMNS:
+            raise QueryError(f"Unknown filter '{param}'")
+        index = table.index(FILTER_COLUMNS[param][0])
+        values[param] = [] if index is None else sorted(index.categories[index.present_codes()].tolist())
+    return values
+
+
+def query_rows(table, filters: Optional[Dict[str, str]] = None, start_date: Optional[str] = None,
+               end_date: Optional[str] = None, sort_by: Optional[str] = None, descending: bool = False,
+               offset: int = 0, limit: Optional[int] = None) -> Tuple[np.ndarray, int]:
+    """Filter, sort and paginate a table.
+
+    Returns the row ids of the requested page and the total number of
+    matching rows.
+    """
+    if offset < 0 or (limit is not None and limit < 0):
+        raise QueryError("offset and limit must not be negative")
+    rows = filter_rows(table, filters or {}, start_date, end_date)
+    total = table.num_rows if rows is None else len(rows)
+    stop = total if limit is None else min(offset + limit, total)
+    if offset >= stop:
+        return np.empty(0, dtype=np.int64), total
+
+    if sort_by is None:
+        if rows is None:
+            return np.arange(offset, stop), total
+        return rows[offset:stop], total
+
+    if rows is None:
+        index = table.index(sort_by)
+        if index is not None and index.num_rows is None:
+            return index.ordered_rows(offset, stop, descending), total
+        rows = np.arange(total)
+
+    keys = table.sort_key(sort_by, rows)
+    if keys is None:
+        raise QueryError(f"Cannot sort by unknown column '{sort_by}'")
+    if descending:
+        keys = -keys  # Missing values (NaN) stay last, as in ColumnIndex.ordered_rows
+    positions = np.arange(len(keys))
+    if stop < len(keys):
+        # Only rows up to the key of the last row on the page need ordering; ties on it included
+        boundary = np.partition(keys, stop - 1)[stop - 1]
+        if not np.isnan(boundary):
+            positions = np.flatnonzero(keys <= boundary)
+    # Ties are ordered by row id, so every page agrees on where each row falls
+    order = positions[np.lexsort((positions, keys[positions]))]
+    return rows[order[offset:stop]], total
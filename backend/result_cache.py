@@ -0,0 +1,120 @@
+"""Size-bounded LRU cache of calculation results.
+
+Results computed from a stored dataset are keyed by what determines them:
+the dataset id and version, a hash of the formula's normalized expression
+and the row filters. Re-running the same formula on the same data is then
+a lookup. Every result, cached or not, can also be fetched by its id while
+it stays in the cache, which is how result pages are served. After a
+dataset gains a version, ``latest_before`` finds the newest cached result of
+the same calculation on an earlier version, to be updated incrementally.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+MAX_CACHE_BYTES = int(os.environ.get("FORMULA_BUILDER_CACHE_MB", 512)) * 1024 * 1024
+
+
+def formula_hash(expression: str) -> str:
+    """Stable hash of a normalized formula expression."""
+    return hashlib.sha1(expression.encode()).hexdigest()
+
+
+def cache_key(dataset_id: str, version: int, expression: str, filters: Optional[Dict]) -> tuple:
+    normalized_filters = {k: v for k, v in (filters or {}).items() if v not in (None, "")}
+    return (dataset_id, version, formula_hash(expression), json.dumps(normalized_filters, sort_keys=True))
+
+
+class ResultCache:
+    """LRU cache bounded by the memory held by its results (``nbytes``).
+
+    Results build indexes on first use, so callers that query a cached
+    result call ``resize`` afterwards to keep the accounting current.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self.by_id: Dict[str, Hashable] = {}
+        self.sizes: Dict[Hashable, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Look up a result, counting the hit or miss."""
+        with self._lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+
+    def get_by_id(self, result_id: str):
+        with self._lock:
+            key = self.by_id.get(result_id)
+            if key is None:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def latest_before(self, key: tuple):
+        """(version, result) cached for ``key`` on the newest earlier dataset version, or None."""
+        dataset_id, version, expression_hash, filters = key
+        with self._lock:
+            earlier = [k for k in self.entries if isinstance(k, tuple) and k[0] == dataset_id
+                       and k[2:] == (expression_hash, filters) and k[1] < version]
+            if not earlier:
+                return None
+            latest = max(earlier, key=lambda k: k[1])
+            return latest[1], self.entries[latest]
+
+    def put(self, key: Hashable, result) -> None:
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = result
+            self.by_id[result.id] = key
+            self.sizes[key] = result.nbytes
+            self.bytes += self.sizes[key]
+            self._evict()
+
+    def resize(self, result_id: str) -> None:
+        """Measure a cached result again, after it has built indexes while being queried."""
+        with self._lock:
+            key = self.by_id.get(result_id)
+            if key is None:
+                return
+            size = self.entries[key].nbytes
+            self.bytes += size - self.sizes[key]
+            self.sizes[key] = size
+            self._evict()
+
+    def _evict(self) -> None:
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        result = self.entries.pop(key)
+        self.by_id.pop(result.id, None)
+        self.bytes -= self.sizes.pop(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,219 @@
+"""Calculation results kept server-side so they can be filtered and paged.
+
+A ``CalculationResult`` holds the computed price and compliance flag as
+arrays alongside the table they were computed from; result rows are only
+built for the page being returned. When rows are appended to a dataset or
+some of its values are corrected, ``CalculationResult.updated`` carries a
+result over to the new version by evaluating only the rows that changed.
+"""
+import copy
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import Table, TableView
+from formula_engine import CompiledFormula
+from query import ColumnIndex, category_ranks
+from schema import MISSING_VALUE
+
+# Columns of a result row, in order
+RESULT_COLUMNS = [
+    "Product",
+    "Price",
+    "Calculated Price",
+    "Regulatory Limit",
+    "Discount",
+    "Compliance Status",
+    "Customer",
+    "Transaction Type",
+    "Date",
+    "Formula Used",
+]
+
+COMPLIANCE_STATUSES = np.array(["Non-Compliant", "Compliant"], dtype=object)
+
+
+def evaluate_formula(compiled: CompiledFormula, table: Table):
+    """Evaluate a compiled formula over every row of a table."""
+    columns = {name: table.column(name) for name in compiled.columns}
+    return compiled.evaluate(columns, len(table))
+
+
+def _row_ids(table: Table) -> Optional[np.ndarray]:
+    return table.row_ids if isinstance(table, TableView) else None
+
+
+def _positions(row_ids: Optional[np.ndarray], num_rows: int, rows: np.ndarray) -> np.ndarray:
+    """Positions of dataset rows ``rows`` among the first ``num_rows`` rows of a table."""
+    if row_ids is None:
+        return rows[rows < num_rows]
+    return np.flatnonzero(np.isin(row_ids, rows))
+
+
+class CalculationResult:
+    """The output of one formula over one table."""
+
+    def __init__(self, table: Table, formula_id: str, formula: Dict, compiled: Optional[CompiledFormula] = None,
+                 calculated: Optional[np.ndarray] = None, missing_inputs: Optional[np.ndarray] = None):
+        """Evaluate ``compiled`` over ``table``, or wrap already computed arrays."""
+        self.id = uuid.uuid4().hex[:12]
+        self.table = table
+        self.formula_id = formula_id
+        self.formula = formula
+        self.created_at = datetime.now().isoformat()
+        if calculated is None:
+            calculated, missing_inputs = evaluate_formula(compiled, table)
+        self.calculated, self.missing_inputs = calculated, missing_inputs
+        # NaN results (e.g. division by zero) can never be shown to be compliant
+        self.compliant = self.calculated <= table.column("Regulatory Limit")
+        self.compliant_count = int(self.compliant.sum())
+        self.missing_count = int(self.missing_inputs.sum())
+        self.rows_computed = len(table)
+        self._compliance_index: Optional[ColumnIndex] = None
+
+    def with_formula(self, formula_id: str, formula: Dict) -> "CalculationResult":
+        """This result labelled with another formula that has the same expression."""
+        if formula_id == self.formula_id and formula is self.formula:
+            return self
+        labelled = copy.copy(self)
+        labelled.formula_id = formula_id
+        labelled.formula = formula
+        return labelled
+
+    def updated(self, table: Table, compiled: CompiledFormula, changes: Dict) -> Optional["CalculationResult"]:
+        """This result carried over to a later version of its dataset.
+
+        ``table`` is the later version, restricted by the same filters, and
+        ``changes`` is what ``Dataset.changes_since`` reports for the version
+        this result was computed from. Only appended rows and corrected rows
+        of columns the formula reads are evaluated. Returns None when the
+        filtered rows changed in a way that needs a full recalculation.
+        """
+        old_ids, new_ids = _row_ids(self.table), _row_ids(table)
+        kept = self.num_rows
+        if (old_ids is None) != (new_ids is None) or len(table) < kept:
+            return None
+        if new_ids is not None:
+            # Corrections to a filtered column can move old rows in or out of the filter
+            if not np.array_equal(new_ids[:kept], old_ids):
+                return None
+            if len(new_ids) > kept and new_ids[kept] < changes["num_rows"]:
+                return None
+
+        corrections = changes["corrections"]
+        empty = np.empty(0, dtype=np.int64)
+        inputs = [_positions(old_ids, kept, rows) for name, rows in corrections.items() if name in compiled.columns]
+        recalculate = np.unique(np.concatenate(inputs)) if inputs else empty
+        limits = (_positions(old_ids, kept, corrections["Regulatory Limit"])
+                  if "Regulatory Limit" in corrections else empty)
+        recheck = np.union1d(recalculate, limits)
+        corrected = [_positions(old_ids, kept, rows) for rows in corrections.values()]
+        appended = np.arange(kept, len(table))
+
+        result = copy.copy(self)
+        result.id = uuid.uuid4().hex[:12]
+        result.created_at = datetime.now().isoformat()
+        result.table = table
+        result._compliance_index = None
+        result.calculated = np.concatenate([self.calculated, np.empty(len(appended))])
+        result.missing_inputs = np.concatenate([self.missing_inputs, np.empty(len(appended), dtype=bool)])
+        result.compliant = np.concatenate([self.compliant, np.empty(len(appended), dtype=bool)])
+
+        # Take the old rows being re-evaluated out of the running counts first
+        result.compliant_count -= int(self.compliant[recheck].sum())
+        result.missing_count -= int(self.missing_inputs[recalculate].sum())
+        for positions in (recalculate, appended):
+            if len(positions):
+                calculated, missing = evaluate_formula(compiled, TableView(table, positions))
+                result.calculated[positions] = calculated
+                result.missing_inputs[positions] = missing
+                result.missing_count += int(missing.sum())
+        for positions in (recheck, appended):
+            if len(positions):
+                compliant = result.calculated[positions] <= TableView(table, positions).column("Regulatory Limit")
+                result.compliant[positions] = compliant
+                result.compliant_count += int(compliant.sum())
+        result.rows_computed = len(recalculate) + len(appended)
+        # Old rows with any corrected value, for rollups kept alongside the result
+        result.revised_positions = np.unique(np.concatenate(corrected + [recheck])).astype(np.int64)
+        return result
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.table)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by this result, for cache accounting."""
+        arrays = self.calculated.nbytes + self.missing_inputs.nbytes + self.compliant.nbytes
+        if self._compliance_index is not None:
+            arrays += self._compliance_index.postings.nbytes + self._compliance_index.offsets.nbytes
+        return arrays + self.table.memory_bytes
+
+    def index(self, name: str) -> Optional[ColumnIndex]:
+        if name == "Compliance Status":
+            if self._compliance_index is None:
+                self._compliance_index = ColumnIndex.build(self.compliant.astype(np.int32), COMPLIANCE_STATUSES)
+            return self._compliance_index
+        return self.table.index(name)
+
+    def sort_key(self, name: str, row_ids: np.ndarray) -> Optional[np.ndarray]:
+        if name == "Calculated Price":
+            return self.calculated[row_ids]
+        if name == "Compliance Status":
+            return category_ranks(COMPLIANCE_STATUSES)[self.compliant[row_ids].astype(np.int64)]
+        return self.table.sort_key(name, row_ids)
+
+    def to_frame(self, row_ids=None) -> pd.DataFrame:
+        """Typed result columns, without "Formula Used", for exports.
+
+        Calculated prices that are not finite and missing discounts are NaN.
+        """
+        table = self.table
+        calculated = self.calculated if row_ids is None else self.calculated[row_ids]
+        compliant = self.compliant if row_ids is None else self.compliant[row_ids]
+        return pd.DataFrame({
+            "Product": table.column("Product", row_ids),
+            "Price": table.column("Price", row_ids),
+            "Calculated Price": np.where(np.isfinite(calculated), calculated, np.nan),
+            "Regulatory Limit": table.column("Regulatory Limit", row_ids),
+            "Discount": table.column("Discount", row_ids),
+            "Compliance Status": COMPLIANCE_STATUSES[compliant.astype(np.int64)],
+            "Customer": table.column("Customer", row_ids),
+            "Transaction Type": table.column("Transaction Type", row_ids),
+            "Date": table.column("Date", row_ids),
+        }, columns=RESULT_COLUMNS[:-1])
+
+    def _display_frame(self, row_ids=None) -> pd.DataFrame:
+        frame = self.to_frame(row_ids)
+        frame["Calculated Price"] = frame["Calculated Price"].astype(object).where(frame["Calculated Price"].notna(), None)
+        frame["Discount"] = frame["Discount"].astype(object).where(frame["Discount"].notna(), MISSING_VALUE)
+        return frame
+
+    def to_rows(self, row_ids=None) -> List[Dict]:
+        """Result rows in the format returned by /api/calculate."""
+        frame = self._display_frame(row_ids)
+        frame["Formula Used"] = self.formula["formula_string"]
+        return frame.to_dict("records")
+
+    def to_columns(self, row_ids=None) -> Dict[str, list]:
+        """The same values as ``to_rows``, one list per column; "Formula Used" is left out."""
+        frame = self._display_frame(row_ids)
+        return {name: frame[name].tolist() for name in frame.columns}
+
+    def summary(self) -> Dict:
+        return {
+            "total_processed": self.num_rows,
+            "compliant_count": self.compliant_count,
+            "non_compliant_count": self.num_rows - self.compliant_count,
+            "rows_with_missing_inputs": self.missing_count,
+            "rows_computed": self.rows_computed,
+            "formula_used": self.formula["formula_string"],
+            "formula_name": self.formula["name"]
+        }
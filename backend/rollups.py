@@ -0,0 +1,265 @@
+"""Pre-aggregated compliance rollups behind /api/reports.
+
+When a calculation is recorded its result is aggregated into a ``Rollup``:
+one cell per distinct Product × Sales Region × Customer × Date combination,
+holding row counts, total sales, calculated price and regulatory limit
+sums, compliant/non-compliant counts and the margin to the regulatory limit.
+Cells are keyed by dictionary codes, which stay valid across versions of a
+dataset, so a result updated incrementally only adds and subtracts the rows
+that changed. Report queries group cells rather than rows, so they cost
+O(cells) whatever the size of the data.
+
+``CalculationHistory`` keeps recorded calculations ordered by time, so
+date-range queries are a binary search, and their rollups up to
+``MAX_ROLLUP_BYTES``, independently of the result cache.
+"""
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset_store import Table, TableView
+from results import CalculationResult
+
+# Report dimension -> column
+DIMENSIONS = {
+    "product": "Product",
+    "transaction_type": "Transaction Type",
+    "customer": "Customer",
+    "date": "Date",
+}
+
+MAX_ROLLUP_BYTES = int(os.environ.get("FORMULA_BUILDER_ROLLUP_MB", 64)) * 1024 * 1024
+
+# Largest code space counted densely with np.bincount rather than sorted
+_DENSE_CELLS = 1 << 24
+
+MEASURES = ["rows", "total_sales", "calculated_price", "regulatory_limit", "margin_to_limit",
+            "compliant_count", "non_compliant_count"]
+
+
+class ReportError(ValueError):
+    """Raised for report queries with unknown dimensions or invalid dates."""
+
+
+def _codes(table: Table, name: str, positions: Optional[np.ndarray]) -> np.ndarray:
+    if not table.has_column(name):
+        return np.full(len(table) if positions is None else len(positions), -1, dtype=np.int32)
+    codes = table.raw(name)
+    return np.asarray(codes if positions is None else codes[positions], dtype=np.int32)
+
+
+def _unique_rows(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct rows of a code matrix and the inverse mapping, like np.unique(axis=0)."""
+    bases = tuple(int(base) for base in keys.max(axis=0).astype(np.int64) + 2)
+    space = np.prod(np.array(bases, dtype=np.float64))
+    if space >= 2 ** 62:
+        cells, inverse = np.unique(keys, axis=0, return_inverse=True)
+        return cells, inverse.reshape(-1)
+    # Number each combination of codes (shifted so missing, -1, becomes 0)
+    flat = np.ravel_multi_index(tuple(keys.T.astype(np.int64) + 1), bases)
+    if space <= max(_DENSE_CELLS, len(keys)):
+        # Few enough combinations to count them all instead of sorting the rows
+        occupied = np.flatnonzero(np.bincount(flat, minlength=int(space)))
+        numbers = np.zeros(int(space), dtype=np.int64)
+        numbers[occupied] = np.arange(len(occupied))
+        inverse = numbers[flat]
+    else:
+        occupied, inverse = np.unique(flat, return_inverse=True)
+    cells = np.column_stack(np.unravel_index(occupied, bases)) - 1
+    return cells.astype(keys.dtype), inverse
+
+
+def _labels(table: Table, name: str) -> np.ndarray:
+    return table.categories(name) if table.has_column(name) else np.array([None], dtype=object)
+
+
+class Rollup:
+    """Measures of a calculation result summed per dimension cell."""
+
+    def __init__(self, cells: np.ndarray, measures: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]):
+        self.cells = cells  # (cells, dimensions) dictionary codes, -1 for missing
+        self.measures = measures
+        self.labels = labels  # column -> categories, decoding codes
+
+    @classmethod
+    def build(cls, result: CalculationResult, positions: Optional[np.ndarray] = None) -> "Rollup":
+        """Aggregate a result, or only the rows at ``positions`` of it."""
+        table = result.table
+        calculated = result.calculated if positions is None else result.calculated[positions]
+        compliant = result.compliant if positions is None else result.compliant[positions]
+        rows = TableView(table, positions) if positions is not None else table
+        keys = np.column_stack([_codes(table, name, positions) for name in DIMENSIONS.values()])
+        limit = rows.column("Regulatory Limit")
+        finite = np.isfinite(calculated)
+        values = {
+            "rows": np.ones(len(calculated)),
+            "total_sales": rows.column("Price"),
+            "calculated_price": np.where(finite, calculated, 0.0),
+            "regulatory_limit": limit,
+            "margin_to_limit": np.where(finite, limit - calculated, 0.0),
+            "compliant_count": compliant.astype(np.float64),
+            "non_compliant_count": (~compliant).astype(np.float64),
+        }
+        labels = {name: _labels(table, name) for name in DIMENSIONS.values()}
+        return cls._group(keys, values, labels)
+
+    @classmethod
+    def _group(cls, keys: np.ndarray, values: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]) -> "Rollup":
+        if not len(keys):
+            return cls(keys.reshape(0, len(DIMENSIONS)), {name: np.zeros(0) for name in MEASURES}, labels)
+        cells, inverse = _unique_rows(keys)
+        measures = {name: np.bincount(inverse, weights=values[name], minlength=len(cells)) for name in MEASURES}
+        return cls(cells, measures, labels)
+
+    def updated(self, previous: CalculationResult, result: CalculationResult) -> "Rollup":
+        """This rollup of ``previous`` carried over to ``result``, its incremental update.
+
+        The old values of revised rows are subtracted and the new values of
+        revised and appended rows are added.
+        """
+        revised = result.revised_positions
+        added = np.concatenate([revised, np.arange(previous.num_rows, result.num_rows)])
+        parts = [(self, 1.0), (Rollup.build(previous, revised), -1.0), (Rollup.build(result, added), 1.0)]
+        keys = np.concatenate([part.cells for part, _ in parts])
+        values = {name: np.concatenate([part.measures[name] * sign for part, sign in parts]) for name in MEASURES}
+        labels = {name: _labels(result.table, name) for name in DIMENSIONS.values()}
+        merged = Rollup._group(keys, values, labels)
+        # Drop cells whose rows all moved to other cells
+        keep = merged.measures["rows"] > 0.5
+        return Rollup(merged.cells[keep], {name: merged.measures[name][keep] for name in MEASURES}, labels)
+
+    @property
+    def nbytes(self) -> int:
+        return self.cells.nbytes + sum(values.nbytes for values in self.measures.values())
+
+    def group(self, dimensions: Sequence[str]) -> List[Dict]:
+        """Measures summed over cells grouped by report ``dimensions``, e.g. ["product", "date"]."""
+        unknown = [dimension for dimension in dimensions if dimension not in DIMENSIONS]
+        if unknown:
+            raise ReportError(f"Cannot group by {', '.join(unknown)}; use {', '.join(DIMENSIONS)}")
+        positions = [list(DIMENSIONS).index(dimension) for dimension in dimensions]
+        if not len(self.cells):
+            return []
+        if positions:
+            groups, inverse = _unique_rows(self.cells[:, positions])
+        else:
+            groups, inverse = np.zeros((1, 0), dtype=np.int32), np.zeros(len(self.cells), dtype=np.int64)
+        sums = {name: np.bincount(inverse, weights=self.measures[name], minlength=len(groups)) for name in MEASURES}
+
+        rows = []
+        for i, codes in enumerate(groups):
+            row = {dimension: self.labels[DIMENSIONS[dimension]][code] for dimension, code in zip(dimensions, codes)}
+            for name in MEASURES:
+                value = float(sums[name][i])
+                row[name] = int(round(value)) if name in ("rows", "compliant_count", "non_compliant_count") else value
+            row["average_margin_to_limit"] = row["margin_to_limit"] / row["rows"] if row["rows"] else None
+            rows.append(row)
+        return rows
+
+
+def _parse_bound(value: Optional[str], end: bool) -> Optional[str]:
+    """An ISO timestamp bound; a bare end date includes that whole day."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ReportError(f"Invalid date: {value}")
+    if end and len(value) <= 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed.isoformat()
+
+
+class CalculationHistory:
+    """Recorded calculations ordered by when they were last updated, with their rollups.
+
+    Rollups are built when a calculation is recorded and kept while their
+    entry is, up to ``max_bytes``, least recently used first out. An evicted
+    rollup is rebuilt from ``results(calculation_id)`` while that still
+    returns the result.
+    """
+
+    def __init__(self, results: Callable[[str], Optional[CalculationResult]], max_bytes: int = MAX_ROLLUP_BYTES):
+        self.entries: List[Dict] = []
+        self.timestamps: List[str] = []
+        self.rollups: "OrderedDict[str, Rollup]" = OrderedDict()  # calculation_id -> rollup
+        self.rollup_bytes = 0
+        self.results = results
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def record(self, entry: Dict, result: CalculationResult, updates: Optional[CalculationResult] = None) -> None:
+        """Add an entry, or move the entry of the result ``result`` updates forward in time."""
+        with self._lock:
+            built = result.id in self.rollups
+            previous_rollup = self.rollups.get(updates.id) if updates is not None else None
+        rollup = None
+        if not built:
+            # Aggregate outside the lock; carrying a rollup over only aggregates the changed rows
+            rollup = previous_rollup.updated(updates, result) if previous_rollup is not None else Rollup.build(result)
+        with self._lock:
+            if rollup is not None:
+                self._keep(result.id, rollup)
+            if updates is not None:
+                i = self._find(updates.id, result.formula_id)
+                if i is not None:
+                    previous = self.entries.pop(i)
+                    self.timestamps.pop(i)
+                    previous.update(entry)
+                    entry = previous
+                if self._find(updates.id) is None:
+                    self._drop(updates.id)
+            i = bisect.bisect_right(self.timestamps, entry["timestamp"])
+            self.timestamps.insert(i, entry["timestamp"])
+            self.entries.insert(i, entry)
+
+    def _find(self, calculation_id: str, formula_id: Optional[str] = None) -> Optional[int]:
+        for i in range(len(self.entries) - 1, -1, -1):
+            entry = self.entries[i]
+            if entry["calculation_id"] == calculation_id and formula_id in (None, entry["formula_id"]):
+                return i
+        return None
+
+    def between(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[Dict]:
+        """Entries recorded between two dates or timestamps, inclusive."""
+        start, end = _parse_bound(start_date, end=False), _parse_bound(end_date, end=True)
+        with self._lock:
+            low = bisect.bisect_left(self.timestamps, start) if start else 0
+            high = bisect.bisect_right(self.timestamps, end) if end else len(self.timestamps)
+            return self.entries[low:high]
+
+    def _keep(self, calculation_id: str, rollup: Rollup) -> None:
+        self._drop(calculation_id)
+        self.rollups[calculation_id] = rollup
+        self.rollup_bytes += rollup.nbytes
+        # Always keep the newest rollup, even if it alone exceeds the budget
+        while self.rollup_bytes > self.max_bytes and len(self.rollups) > 1:
+            self._drop(next(iter(self.rollups)))
+
+    def _drop(self, calculation_id: str) -> None:
+        rollup = self.rollups.pop(calculation_id, None)
+        if rollup is not None:
+            self.rollup_bytes -= rollup.nbytes
+
+    def rollup(self, calculation_id: str) -> Optional[Rollup]:
+        """The rollup of a recorded calculation, or None if it was evicted and its result is gone."""
+        with self._lock:
+            if calculation_id in self.rollups:
+                self.rollups.move_to_end(calculation_id)
+                return self.rollups[calculation_id]
+        result = self.results(calculation_id)
+        if result is None:
+            return None
+        rollup = Rollup.build(result)
+        with self._lock:
+            if self._find(calculation_id) is not None:
+                self._keep(calculation_id, rollup)
+        return rollup
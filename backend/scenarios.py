@@ -0,0 +1,87 @@
+"""Side-by-side comparison of several formulas over the same rows.
+
+The formulas are evaluated together as a ``FormulaBatch``, so the columns
+they read are loaded once and subexpressions they have in common (such as
+``Sale Price - Discount Amount - Chargeback Amount``) are computed once.
+Each formula still gets its own ``CalculationResult``; this module lines
+them up into comparison rows, a compliance matrix and summary deltas
+against the first (baseline) formula.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from dataset_store import Table
+from formula_engine import CompiledFormula, FormulaBatch
+from results import COMPLIANCE_STATUSES, CalculationResult
+
+# Row columns shown next to the per-formula values
+CONTEXT_COLUMNS = ["Product", "Customer", "Transaction Type", "Date", "Price", "Regulatory Limit"]
+
+
+def calculate_batch(table: Table, formulas: Sequence[Tuple[str, Dict, CompiledFormula]]) -> List[CalculationResult]:
+    """Evaluate (formula_id, formula, compiled) entries over ``table`` in one pass."""
+    batch = FormulaBatch([compiled for _, _, compiled in formulas])
+    columns = {name: table.column(name) for name in batch.columns}
+    outputs = batch.evaluate(columns, len(table))
+    return [
+        CalculationResult(table, formula_id, formula, calculated=calculated, missing_inputs=missing)
+        for (formula_id, formula, _), (calculated, missing) in zip(formulas, outputs)
+    ]
+
+
+def comparison_rows(results: Sequence[CalculationResult], row_ids: np.ndarray) -> List[Dict]:
+    """Rows ``row_ids`` of the input, each with every formula's calculated price and compliance status."""
+    table = results[0].table
+    context = {name: table.column(name, row_ids).tolist() for name in CONTEXT_COLUMNS}
+    prices = {}
+    statuses = {}
+    for result in results:
+        calculated = result.calculated[row_ids]
+        compliant = result.compliant[row_ids]
+        prices[result.formula_id] = np.where(np.isfinite(calculated), calculated, None).tolist()
+        statuses[result.formula_id] = COMPLIANCE_STATUSES[compliant.astype(np.int64)].tolist()
+
+    rows = []
+    for i in range(len(context["Product"])):
+        row = {name: values[i] for name, values in context.items()}
+        row["Calculated Price"] = {formula_id: values[i] for formula_id, values in prices.items()}
+        row["Compliance Status"] = {formula_id: values[i] for formula_id, values in statuses.items()}
+        rows.append(row)
+    return rows
+
+
+def _total(result: CalculationResult) -> float:
+    # Non-finite prices (e.g. division by zero) are shown as missing, so leave them out
+    calculated = result.calculated
+    return float(calculated[np.isfinite(calculated)].sum())
+
+
+def compare(results: Sequence[CalculationResult]) -> Dict:
+    """Compliance matrix and summary deltas of each formula against the first.
+
+    ``compliance_matrix[i][j]`` is the number of rows compliant under both
+    formula ``i`` and formula ``j``; the diagonal is each formula's compliant
+    count.
+    """
+    compliant = np.column_stack([result.compliant for result in results]).astype(np.int64)
+    matrix = compliant.T @ compliant
+    baseline = results[0]
+    baseline_total = _total(baseline)
+    deltas = []
+    for result in results:
+        total = _total(result)
+        deltas.append({
+            "formula_id": result.formula_id,
+            "formula_name": result.formula["name"],
+            "compliant_count": result.compliant_count - baseline.compliant_count,
+            "non_compliant_count": baseline.compliant_count - result.compliant_count,
+            "total_calculated_price": total - baseline_total,
+            "became_compliant": int((result.compliant & ~baseline.compliant).sum()),
+            "became_non_compliant": int((baseline.compliant & ~result.compliant).sum())
+        })
+    return {
+        "formula_ids": [result.formula_id for result in results],
+        "compliance_matrix": matrix.tolist(),
+        "summary_deltas": deltas
+    }
@@ -0,0 +1,75 @@
+"""Column definitions shared by the upload, storage and calculation code."""
+import re
+
+# Uploaded column name -> column name used throughout the API and frontend
+COLUMN_MAPPING = {
+    'Transaction ID': 'Transaction ID',
+    'Drug Name': 'Product',
+    'Sale Price (USD)': 'Sale Price',
+    'Discount Amount (USD)': 'Discount Amount',
+    'Chargeback Amount (USD)': 'Chargeback Amount',
+    'Rebate Amount (USD)': 'Rebate Amount',
+    'Admin Fees (USD)': 'Admin Fees',
+    'Free Goods Adjustments': 'Free Goods Adjustments',
+    'Units Sold': 'Units Sold',
+    'Exclusion Flag': 'Exclusion Flag',
+    'Manufacturer': 'Manufacturer',
+    'Sales Year': 'Date',
+    'Total Sales (USD)': 'Price',
+    'Discount Percentage (%)': 'Discount',
+    'Customer Category': 'Customer',
+    'Sales Region': 'Transaction Type',
+    'Regulatory Price Limit (USD)': 'Regulatory Limit',
+    'Pricing Compliance Status': 'Status',
+    'Number of Free Goods': 'Free Goods',
+    'Volume Tier Discount (USD)': 'Volume Discount',
+    'Competitor Price (USD)': 'Competitor Price',
+    'Profit Margin (%)': 'Profit Margin',
+    'Market Segment': 'Market Segment'
+}
+
+ALL_COLUMNS = list(COLUMN_MAPPING.values())
+
+# Minimum required columns for basic functionality
+MINIMUM_REQUIRED_COLUMNS = [
+    'Drug Name',
+    'Total Sales (USD)',
+    'Discount Percentage (%)'
+]
+
+# Missing values in these columns are stored as 0.0
+FLOAT_COLUMNS = ['Price', 'Discount Amount', 'Regulatory Limit', 'Sale Price',
+                 'Chargeback Amount', 'Rebate Amount', 'Admin Fees', 'Volume Discount',
+                 'Competitor Price']
+
+# Missing values in these columns are stored as 0
+INT_COLUMNS = ['Units Sold', 'Free Goods']
+
+# Missing values in these columns are shown as MISSING_VALUE
+PERCENT_COLUMNS = ['Discount', 'Profit Margin']
+
+MISSING_VALUE = "--"
+
+# High-cardinality text stored as UTF-8 bytes with end offsets rather than
+# dictionary-encoded; a dictionary would hold one entry per row
+STRING_COLUMNS = ['Transaction ID', 'Free Goods Adjustments']
+
+# Text columns indexed at upload time for server-side filtering
+INDEXED_COLUMNS = ['Product', 'Customer', 'Manufacturer', 'Transaction Type', 'Date', 'Status']
+
+NUMERIC_COLUMNS = FLOAT_COLUMNS + INT_COLUMNS + PERCENT_COLUMNS
+TEXT_COLUMNS = [col for col in ALL_COLUMNS if col not in NUMERIC_COLUMNS]
+
+
+def _build_variable_aliases():
+    # Formulas may refer to a column by its internal name, its uploaded name,
+    # or its uploaded name without the unit suffix ("Total Sales").
+    aliases = {}
+    for uploaded, internal in COLUMN_MAPPING.items():
+        aliases[internal.lower()] = internal
+        aliases[uploaded.lower()] = internal
+        aliases[re.sub(r'\s*\((USD|%)\)$', '', uploaded).lower()] = internal
+    return aliases
+
+
+VARIABLE_ALIASES = _build_variable_aliases()
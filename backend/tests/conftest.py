@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep datasets written by tests out of backend/data; must be set before dataset_store is imported
+os.environ.setdefault("FORMULA_BUILDER_DATA_DIR", tempfile.mkdtemp(prefix="formula-builder-tests-"))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_store import DatasetStore, normalize_frame
+
+
+def sales_frame(rows: int, seed: int = 0, first_id: int = 0) -> pd.DataFrame:
+    """Sales rows with the internal column names, including blank discounts."""
+    rng = np.random.default_rng(seed)
+    discounts = rng.choice([5.0, 10.0, 20.5], rows)
+    discounts[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        "Transaction ID": [f"T{first_id + i}" for i in range(rows)],
+        "Product": rng.choice(["A", "B", "C"], rows),
+        "Price": rng.uniform(100, 1000, rows).round(2),
+        "Discount": discounts,
+        "Customer": rng.choice(["Government", "Retail", "Hospital"], rows),
+        "Transaction Type": rng.choice(["North", "South"], rows),
+        "Regulatory Limit": rng.uniform(100, 1000, rows).round(2),
+        "Date": rng.choice(["2021", "2022", "2023"], rows),
+        "Units Sold": rng.integers(1, 5, rows),
+    })
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DatasetStore(str(tmp_path))
+
+
+@pytest.fixture
+def write_rows(store):
+    """Store a frame as a new dataset, or append it to ``dataset_id``; returns the new version."""
+    def write(frame: pd.DataFrame, dataset_id=None):
+        writer = store.create("sales.csv") if dataset_id is None else store.open(dataset_id)
+        writer.write(normalize_frame(frame), len(frame))
+        return writer.commit()
+    return write
+
+
+@pytest.fixture
+def correct_rows(store):
+    """Correct ``{column: (rows, values)}`` of a dataset as one new version, as the corrections endpoint does."""
+    def correct(dataset_id, corrections):
+        writer = store.open(dataset_id)
+        for name, (rows, values) in corrections.items():
+            values = normalize_frame(pd.DataFrame({name: pd.Series(values, dtype=object)}))[name]
+            writer.correct(name, np.asarray(rows), values)
+        return writer.commit()
+    return correct
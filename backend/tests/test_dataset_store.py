@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import sales_frame
+from dataset_store import normalize_frame
+
+
+def test_old_versions_keep_values_after_a_correction(store, write_rows, correct_rows):
+    original = write_rows(sales_frame(20))
+    before = {name: original.column(name).tolist() for name in ("Product", "Price", "Transaction ID", "Discount")}
+    corrected = correct_rows(original.id, {
+        "Product": ([1, 2], ["Z", "Z"]),
+        "Price": ([3], [1.5]),
+        "Transaction ID": ([4], ["a much longer transaction id"]),
+        "Discount": ([5], [None]),
+    })
+
+    assert corrected.version == 2
+    assert corrected.column("Product")[[1, 2]].tolist() == ["Z", "Z"]
+    assert corrected.column("Price")[3] == 1.5
+    assert corrected.column("Transaction ID")[[3, 4, 5]].tolist() == ["T3", "a much longer transaction id", "T5"]
+    assert np.isnan(corrected.column("Discount")[5])
+
+    old = store.get(original.id, 1)
+    for name, values in before.items():
+        np.testing.assert_array_equal(old.column(name), np.array(values, dtype=old.column(name).dtype))
+    # Indexes are per version, so filtering the old version still sees the old products
+    old_index, index = old.index("Product"), corrected.index("Product")
+    assert "Z" not in old_index.categories[old_index.present_codes()].tolist()
+    assert index.rows([index.categories.tolist().index("Z")]).tolist() == [1, 2]
+
+
+def test_old_versions_read_after_correcting_a_column_the_upload_lacked(store, write_rows, correct_rows):
+    original = write_rows(sales_frame(5))
+    assert not original.has_column("Sale Price")
+    corrected = correct_rows(original.id, {"Sale Price": ([0], [5]), "Market Segment": ([1], ["Brand"])})
+
+    assert corrected.column("Sale Price").tolist() == [5.0, 0.0, 0.0, 0.0, 0.0]
+    assert corrected.column("Market Segment")[1] == "Brand"
+    old = store.get(original.id, 1)
+    assert not old.has_column("Sale Price") and not old.has_column("Market Segment")
+    assert old.to_rows()[0]["Sale Price"] is None
+
+
+def test_changes_since(store, write_rows, correct_rows):
+    first = write_rows(sales_frame(10))
+    correct_rows(first.id, {"Price": ([1, 3], [1.0, 2.0])})
+    write_rows(sales_frame(5, seed=1, first_id=10), first.id)
+    latest = correct_rows(first.id, {"Price": ([3, 12], [3.0, 4.0]), "Product": ([0], ["Z"])})
+
+    changes = latest.changes_since(1)
+    assert changes["num_rows"] == 10
+    assert {name: rows.tolist() for name, rows in changes["corrections"].items()} == {
+        "Price": [1, 3, 12], "Product": [0]}
+    assert latest.changes_since(3)["num_rows"] == 15
+    assert latest.changes_since(4) == {"num_rows": 15, "corrections": {}}
+    with pytest.raises(KeyError):
+        store.get(first.id, 2).changes_since(3)
+    with pytest.raises(KeyError):
+        latest.changes_since(9)
+
+
+def test_corrections_are_written_to_revision_files(store, write_rows, correct_rows):
+    original = write_rows(sales_frame(10))
+    correct_rows(original.id, {"Price": ([0], [1.0]), "Transaction ID": ([0], ["X"])})
+    correct_rows(original.id, {"Price": ([1], [2.0])})
+
+    revisions = store.datasets[original.id]["columns"]["Price"]["revisions"]
+    assert [revision["version"] for revision in revisions] == [2, 3]
+    for revision in revisions:
+        assert os.path.exists(os.path.join(store.dataset_path(original.id), revision["file"] + ".bin"))
+    assert store.get(original.id, 2).column("Price")[:2].tolist() == [1.0, original.column("Price")[1]]
+    assert store.get(original.id, 3).column("Price")[:2].tolist() == [1.0, 2.0]
+
+
+def test_abort_discards_a_correction(store, write_rows):
+    original = write_rows(sales_frame(10))
+    files = set(os.listdir(store.dataset_path(original.id)))
+    writer = store.open(original.id)
+    writer.correct("Price", np.array([0]), np.array([1.0]))
+    writer.correct("Transaction ID", np.array([0]), np.array(["X"], dtype=object))
+    writer.correct("Sale Price", np.array([0]), np.array([1.0]))
+    writer.abort()
+
+    assert set(os.listdir(store.dataset_path(original.id))) == files
+    latest = store.get(original.id)
+    assert latest.version == 1 and not latest.has_column("Sale Price")
+    assert latest.column("Price")[0] == original.column("Price")[0]
+    assert latest.column("Transaction ID")[0] == "T0"
+    # The dataset can be written again
+    store.open(original.id).abort()
+
+
+def test_abort_discards_appended_rows(store, write_rows):
+    original = write_rows(sales_frame(10))
+    sizes = {name: os.path.getsize(os.path.join(store.dataset_path(original.id), name))
+             for name in os.listdir(store.dataset_path(original.id))}
+    writer = store.open(original.id)
+    frame = sales_frame(5, seed=1, first_id=10)
+    frame["Transaction ID"] = "a longer id than before"
+    writer.write(normalize_frame(frame), len(frame))
+    writer.abort()
+
+    assert {name: os.path.getsize(os.path.join(store.dataset_path(original.id), name))
+            for name in os.listdir(store.dataset_path(original.id))} == sizes
+    appended = write_rows(sales_frame(3, seed=2, first_id=10), original.id)
+    assert appended.version == 2 and len(appended) == 13
+    assert appended.column("Transaction ID")[8:].tolist() == ["T8", "T9", "T10", "T11", "T12"]
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from formula_engine import FormulaBatch, FormulaError, compile_formula
+
+
+def evaluate(formula_string, columns=None, length=1):
+    return compile_formula(formula_string).evaluate(columns or {}, length)
+
+
+@pytest.mark.parametrize("formula_string, expected", [
+    ("-2^2", -4.0),
+    ("(-2)^2", 4.0),
+    ("2^3^2", 512.0),
+    ("2^-1", 0.5),
+    ("2*3^2", 18.0),
+    ("1 + 2 * 3 - 4 / 2", 5.0),
+    ("10 - 4 - 3", 3.0),
+    ("2 + 3 > 4", 1.0),
+])
+def test_precedence(formula_string, expected):
+    result, missing = evaluate(formula_string)
+    assert result.tolist() == [expected]
+    assert not missing.any()
+
+
+def test_column_aliases_resolve_to_internal_names():
+    compiled = compile_formula("Total Sales (USD) * (1 - discount percentage (%) / 100)")
+    assert compiled.columns == {"Price", "Discount"}
+    assert compiled.expression == compile_formula("Price * (1 - Discount / 100)").expression
+
+
+def test_longest_alias_wins():
+    assert compile_formula("Sale Price - Price").columns == {"Sale Price", "Price"}
+
+
+def test_unknown_name_is_rejected():
+    with pytest.raises(FormulaError):
+        compile_formula("Total Salez * 2")
+
+
+def test_text_comparison_with_missing_values():
+    products = np.array(["A", None, "B"], dtype=object)
+    equal, _ = evaluate('if(Product == "A", 1, 2)', {"Product": products}, 3)
+    not_equal, _ = evaluate('if(Product != "A", 1, 2)', {"Product": products}, 3)
+    assert equal.tolist() == [1.0, 2.0, 2.0]
+    assert not_equal.tolist() == [2.0, 1.0, 1.0]
+
+
+@pytest.mark.parametrize("formula_string, message", [
+    ("if(1, 2)", "Wrong number of arguments to if()"),
+    ("if(1, 2, 3, 4)", "Wrong number of arguments to if()"),
+    ("if(Product, 1, 2)", "if() needs a condition and two numeric values"),
+    ('if(1 > 0, Product, 2)', "if() needs a condition and two numeric values"),
+    ("min()", "Wrong number of arguments to min()"),
+    ("max(Price, Product)", "max() only accepts numeric values"),
+    ("round(1, 2, 3)", "Wrong number of arguments to round()"),
+    ("round(Price, Units Sold)", "round() digits must be a constant number"),
+    ('Product > "A"', "Text values can only be compared with '==' or '!='"),
+    ("Product == 1", "Cannot compare text with a number using '=='"),
+    ("-Product", "Cannot negate a text value"),
+    ("Product", "Formula must produce a number, not text"),
+    ('"abc"', "Formula must produce a number, not text"),
+])
+def test_invalid_formulas(formula_string, message):
+    with pytest.raises(FormulaError) as error:
+        compile_formula(formula_string)
+    assert str(error.value) == message
+
+
+def test_functions():
+    columns = {"Price": np.array([1.25, -3.5, 10.0]), "Sale Price": np.array([2.0, -4.0, 5.0])}
+    assert evaluate("min(Price, Sale Price, 3)", columns, 3)[0].tolist() == [1.25, -4.0, 3.0]
+    assert evaluate("max(Price, Sale Price)", columns, 3)[0].tolist() == [2.0, -3.5, 10.0]
+    assert evaluate("abs(Price)", columns, 3)[0].tolist() == [1.25, 3.5, 10.0]
+    assert evaluate("round(Price, 1)", columns, 3)[0].tolist() == [1.2, -3.5, 10.0]
+    assert evaluate("if(Price > Sale Price, Price, Sale Price)", columns, 3)[0].tolist() == [2.0, -3.5, 10.0]
+
+
+def test_missing_values_count_as_zero_and_are_masked():
+    columns = {
+        "Price": np.array([100.0, 100.0, np.nan, 100.0]),
+        "Discount": np.array([10.0, np.nan, 10.0, None], dtype=object),
+        "Units Sold": np.array([1.0, 1.0, 1.0, np.nan]),
+    }
+    result, missing = evaluate("Price * (1 - Discount / 100)", columns, 4)
+    assert result.tolist() == [90.0, 100.0, 0.0, 100.0]
+    assert missing.tolist() == [False, True, True, True]
+
+
+def test_missing_mask_only_covers_referenced_columns():
+    columns = {"Price": np.array([1.0, 2.0]), "Discount": np.array([np.nan, np.nan])}
+    _, missing = evaluate("Price * 2", columns, 2)
+    assert not missing.any()
+
+
+def test_division_by_zero_is_not_finite():
+    result, _ = evaluate("Price / Sale Price", {"Price": np.array([1.0, 0.0]), "Sale Price": np.array([0.0, 0.0])}, 2)
+    assert np.isinf(result[0]) and np.isnan(result[1])
+
+
+def test_batch_matches_separate_evaluation():
+    formulas = [compile_formula(f) for f in ("Price * 2 + 1", "(Price * 2) - Discount", "min(Price * 2, 5)")]
+    columns = {"Price": np.array([1.0, 2.0, np.nan]), "Discount": np.array([0.5, np.nan, 1.0])}
+    batch = FormulaBatch(formulas)
+    assert "(Price * 2.0)" in batch.shared
+    for formula, (result, missing) in zip(formulas, batch.evaluate(columns, 3)):
+        expected, expected_missing = formula.evaluate(columns, 3)
+        np.testing.assert_array_equal(result, expected)
+        np.testing.assert_array_equal(missing, expected_missing)
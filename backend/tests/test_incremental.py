@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+
+from conftest import sales_frame
+from dataset_store import TableView
+from formula_engine import compile_formula
+from query import filter_rows
+from results import CalculationResult
+from rollups import DIMENSIONS, Rollup
+
+FORMULA = {"name": "Net Price", "formula_string": "Price * (1 - Discount / 100)"}
+COMPILED = compile_formula(FORMULA["formula_string"])
+
+# name -> (corrections or None to append, filters)
+SCENARIOS = {
+    "append": (None, {}),
+    "append, filtered": (None, {"product": "A"}),
+    "formula input": ({"Price": ([0, 5, 17], [1.0, 2000.0, 50.0])}, {}),
+    "formula input, filtered": ({"Price": ([0, 5, 17], [1.0, 2000.0, 50.0])}, {"customer": "Retail"}),
+    "missing input": ({"Discount": ([1, 2, 3], [None, 50, None])}, {}),
+    "limit": ({"Regulatory Limit": ([4, 6, 8], [0.0, 5000.0, 1.0])}, {}),
+    "limit, filtered": ({"Regulatory Limit": ([4, 6, 8], [0.0, 5000.0, 1.0])}, {"product": "B"}),
+    "dimension": ({"Product": ([0, 1, 2], ["Z", "A", "A"]), "Date": ([3], ["1999"])}, {}),
+    "dimension, filtered by another column": ({"Customer": ([0, 1, 2], ["Retail"] * 3)}, {"product": "C"}),
+}
+
+
+def view(table, filters):
+    rows = filter_rows(table, filters)
+    return table if rows is None else TableView(table, rows)
+
+
+def assert_same_result(incremental, full):
+    np.testing.assert_array_equal(incremental.calculated, full.calculated)
+    np.testing.assert_array_equal(incremental.missing_inputs, full.missing_inputs)
+    np.testing.assert_array_equal(incremental.compliant, full.compliant)
+    assert {**incremental.summary(), "rows_computed": None} == {**full.summary(), "rows_computed": None}
+
+
+def assert_same_rollup(incremental, full):
+    for dimensions in ([], ["product"], ["customer", "date"], list(DIMENSIONS)):
+        expected = full.group(dimensions)
+        groups = incremental.group(dimensions)
+        assert len(groups) == len(expected)
+        for group, row in zip(groups, expected):
+            assert group == pytest.approx(row)
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_incremental_result_equals_full_recompute(scenario, store, write_rows, correct_rows):
+    corrections, filters = SCENARIOS[scenario]
+    original = write_rows(sales_frame(60))
+    base = CalculationResult(view(original, filters), "1", FORMULA, COMPILED)
+    rollup = Rollup.build(base)
+
+    if corrections is None:
+        latest = write_rows(sales_frame(25, seed=1, first_id=60), original.id)
+    else:
+        latest = correct_rows(original.id, corrections)
+    table = view(latest, filters)
+    updated = base.updated(table, COMPILED, latest.changes_since(original.version))
+    full = CalculationResult(table, "1", FORMULA, COMPILED)
+
+    assert updated is not None
+    assert updated.rows_computed < full.rows_computed
+    assert_same_result(updated, full)
+    assert_same_rollup(rollup.updated(base, updated), Rollup.build(full))
+
+
+def test_incremental_result_over_several_versions(store, write_rows, correct_rows):
+    original = write_rows(sales_frame(60))
+    base = CalculationResult(original, "1", FORMULA, COMPILED)
+    rollup = Rollup.build(base)
+    correct_rows(original.id, {"Price": ([2], [10.0]), "Product": ([3], ["Z"])})
+    write_rows(sales_frame(10, seed=1, first_id=60), original.id)
+    latest = correct_rows(original.id, {"Price": ([2, 65], [20.0, 30.0])})
+
+    updated = base.updated(latest, COMPILED, latest.changes_since(original.version))
+    full = CalculationResult(latest, "1", FORMULA, COMPILED)
+    assert updated.rows_computed == 1 + 10
+    assert_same_result(updated, full)
+    assert_same_rollup(rollup.updated(base, updated), Rollup.build(full))
+
+
+def test_corrections_that_move_rows_across_a_filter_need_a_full_recompute(store, write_rows, correct_rows):
+    original = write_rows(sales_frame(60))
+    filters = {"product": "A"}
+    base = CalculationResult(view(original, filters), "1", FORMULA, COMPILED)
+    outside = int(np.flatnonzero(original.column("Product") != "A")[0])
+    latest = correct_rows(original.id, {"Product": ([outside], ["A"])})
+
+    assert base.updated(view(latest, filters), COMPILED, latest.changes_since(original.version)) is None
+
+
+def test_calculate_endpoint_updates_incrementally():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    frame = sales_frame(80).rename(columns={"Product": "Drug Name", "Price": "Total Sales (USD)",
+                                            "Discount": "Discount Percentage (%)", "Date": "Sales Year"})
+    with TestClient(main.app) as client:
+        upload = client.post("/api/upload", params={"include_data": "false"},
+                             files={"file": ("sales.csv", frame.to_csv(index=False).encode(), "text/csv")})
+        dataset_id = upload.json()["dataset_id"]
+        formula_ids = [client.post("/api/formulas", json={"name": name, "description": "", "formula_string": text})
+                       .json()["id"] for name, text in (("Net", "Total Sales * (1 - Discount Percentage / 100)"),
+                                                        ("Same", "(1 - Discount Percentage / 100) * Total Sales"))]
+        calculation = {"dataset_id": dataset_id, "include_results": False}
+        client.post("/api/calculate", json={**calculation, "formula_id": formula_ids[0]})
+        client.get("/api/reports", params={"formula_id": formula_ids[0]})
+
+        client.post(f"/api/datasets/{dataset_id}/corrections",
+                    json={"corrections": [{"column": "Total Sales", "row": 3, "value": 1},
+                                          {"column": "Drug Name", "transaction_id": "T4", "value": "Z"}]})
+        incremental = client.post("/api/calculate", json={**calculation, "formula_id": formula_ids[0]}).json()
+        full = client.post("/api/calculate", json={**calculation, "formula_id": formula_ids[1]}).json()
+        assert incremental["summary"]["rows_computed"] == 1
+        assert full["summary"]["rows_computed"] == 80
+        for key in ("compliant_count", "non_compliant_count", "rows_with_missing_inputs"):
+            assert incremental["summary"][key] == full["summary"][key]
+
+        reports = [client.get("/api/reports", params={"calculation_id": result["calculation_id"],
+                                                      "group_by": "product,date"}).json()["rollup"]["groups"]
+                   for result in (incremental, full)]
+        assert reports[0] == pytest.approx(reports[1])
+
+        # The first version still reads its original values
+        old = client.get("/api/data", params={"dataset_id": dataset_id, "version": 1, "limit": 5}).json()["data"]
+        assert old[3]["Price"] == frame["Total Sales (USD)"][3]
+        assert old[4]["Product"] == frame["Drug Name"][4]
@@ -0,0 +1,69 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import jobs
+import main
+from conftest import sales_frame
+from jobs import CalculationJob, JobRegistry
+
+FORMULA = {"name": "Net Price", "formula_string": "Price * (1 - Discount / 100)"}
+
+
+def test_a_job_cancelled_before_it_starts_submits_nothing(store, write_rows, monkeypatch):
+    def no_pool():
+        raise AssertionError("shards were submitted")
+    monkeypatch.setattr(jobs, "get_pool", no_pool)
+    job = CalculationJob(write_rows(sales_frame(10)), "1", FORMULA)
+
+    assert job.cancel()
+    job.run()
+    assert job.status == "cancelled" and job.finished_at is not None
+    assert not job.cancel()
+
+
+def test_registry_forgets_the_oldest_finished_jobs():
+    registry = JobRegistry(max_finished=2)
+    running = SimpleNamespace(id="running", finished_at=None)
+    registry.add(running)
+    for i in range(4):
+        registry.add(SimpleNamespace(id=f"done {i}", finished_at=f"2024-01-0{i + 1}"))
+
+    assert list(registry.jobs) == ["running", "done 2", "done 3"]
+    assert registry.get("done 0") is None and registry.get("running") is running
+
+
+def wait_for(client, job_id):
+    for _ in range(600):
+        job = client.get(f"/api/calculate/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    pytest.fail("calculation job did not finish")
+
+
+def test_job_results_are_served_from_the_result_cache(monkeypatch):
+    frame = sales_frame(30).rename(columns={"Product": "Drug Name", "Price": "Total Sales (USD)",
+                                            "Discount": "Discount Percentage (%)", "Date": "Sales Year"})
+    with TestClient(main.app) as client:
+        dataset_id = client.post("/api/upload", params={"include_data": "false"}, files={
+            "file": ("sales.csv", frame.to_csv(index=False).encode(), "text/csv")}).json()["dataset_id"]
+        formula_id = client.post("/api/formulas", json={"name": "Job", "description": "",
+                                                        "formula_string": "Total Sales * 3"}).json()["id"]
+        job = client.post("/api/calculate/jobs", json={"formula_id": formula_id, "dataset_id": dataset_id}).json()
+        job = wait_for(client, job["job_id"])
+        assert job["status"] == "completed"
+        assert not hasattr(main.calculation_jobs.get(job["job_id"]), "result")
+
+        page = client.get(f"/api/calculate/jobs/{job['job_id']}/results", params={"limit": 5}).json()
+        assert page["calculation_id"] == job["calculation_id"] and page["total"] == 30
+
+        # Another calculation pushes the job's result out of the cache
+        monkeypatch.setattr(main.result_cache, "max_bytes", 0)
+        other = client.post("/api/formulas", json={"name": "Other", "description": "",
+                                                   "formula_string": "Total Sales * 4"}).json()["id"]
+        client.post("/api/calculate", json={"formula_id": other, "dataset_id": dataset_id, "include_results": False})
+        response = client.get(f"/api/calculate/jobs/{job['job_id']}/results")
+        assert response.status_code == 404
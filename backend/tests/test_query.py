@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from conftest import sales_frame
+from dataset_store import TableView
+from formula_engine import compile_formula
+from query import query_rows
+from result_cache import ResultCache
+from results import CalculationResult
+
+
+@pytest.fixture
+def dataset(write_rows):
+    frame = sales_frame(500)
+    # Plenty of ties, and missing values in the text columns
+    frame["Price"] = frame["Price"].round(-2)
+    frame.loc[::7, "Product"] = None
+    frame.loc[::11, "Customer"] = None
+    return write_rows(frame)
+
+
+def pages(table, page_size=20, **query):
+    rows, total = query_rows(table, limit=0, **query)
+    return np.concatenate([query_rows(table, offset=offset, limit=page_size, **query)[0]
+                           for offset in range(0, total, page_size)]), total
+
+
+@pytest.mark.parametrize("sort_by", ["Discount", "Price", "Product", "Customer", "Transaction ID"])
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("filters", [{}, {"customer": "i"}, {"product": "A"}])
+def test_pages_of_a_sorted_result_cover_every_row_once(dataset, sort_by, descending, filters):
+    paged, total = pages(dataset, filters=filters, sort_by=sort_by, descending=descending)
+    everything, _ = query_rows(dataset, filters=filters, sort_by=sort_by, descending=descending)
+
+    assert len(paged) == total == len(np.unique(paged))
+    np.testing.assert_array_equal(paged, everything)
+    keys = dataset.sort_key(sort_by, paged)
+    present = ~np.isnan(keys)
+    # Missing values come last; the rest are in order with ties by row id
+    assert present[:present.sum()].all()
+    keys, rows = keys[present], paged[present]
+    steps = np.diff(-keys if descending else keys)
+    assert (steps >= 0).all()
+    assert (np.diff(rows)[steps == 0] > 0).all()
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_index_and_filtered_sorts_agree(dataset, descending):
+    # Unfiltered, Product is sorted from its index; a filter matching every row sorts by key
+    indexed, _ = query_rows(dataset, sort_by="Product", descending=descending)
+    everything = {"transaction_type": "th"}
+    assert query_rows(dataset, filters=everything, limit=0)[1] == len(dataset)
+    by_key, _ = query_rows(dataset, filters=everything, sort_by="Product", descending=descending)
+    np.testing.assert_array_equal(indexed, by_key)
+    assert dataset.column("Product", indexed[-1:])[0] is None
+
+
+def test_cached_results_are_resized_as_they_build_indexes(dataset):
+    view = TableView(dataset, query_rows(dataset, filters={"customer": "i"})[0])
+    result = CalculationResult(view, "f", {"formula_string": "Price * (1 - Discount)"},
+                               compile_formula("Price * (1 - Discount)"))
+    cache = ResultCache()
+    cache.put("key", result)
+    size = result.nbytes
+
+    # Reading and sorting columns of the view gathers rows per request rather than keeping copies
+    query_rows(result, sort_by="Price", offset=10, limit=20)
+    result.to_rows(np.arange(20))
+    assert result.nbytes == size
+
+    query_rows(result, filters={"compliance_status": "Compliant", "product": "A"}, sort_by="Product")
+    assert result.nbytes > size
+    cache.resize(result.id)
+    assert cache.bytes == cache.sizes["key"] == result.nbytes
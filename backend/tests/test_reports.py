@@ -0,0 +1,68 @@
+from fastapi.testclient import TestClient
+
+import main
+from conftest import sales_frame
+from formula_engine import compile_formula
+from results import CalculationResult
+from rollups import CalculationHistory, Rollup
+
+FORMULA = {"name": "Net Price", "formula_string": "Price * (1 - Discount / 100)"}
+
+
+def upload_csv(client, frame):
+    frame = frame.rename(columns={"Product": "Drug Name", "Price": "Total Sales (USD)",
+                                  "Discount": "Discount Percentage (%)", "Date": "Sales Year"})
+    return client.post("/api/upload", params={"include_data": "false"},
+                       files={"file": ("sales.csv", frame.to_csv(index=False).encode(), "text/csv")}).json()
+
+
+def calculate_two_formulas(client):
+    dataset_id = upload_csv(client, sales_frame(50))["dataset_id"]
+    formula_ids = [client.post("/api/formulas", json={"name": f"F{i}", "description": "",
+                                                      "formula_string": f"Total Sales * {i + 2}"}).json()["id"]
+                   for i in range(2)]
+    for formula_id in formula_ids:
+        client.post("/api/calculate", json={"formula_id": formula_id, "dataset_id": dataset_id,
+                                            "include_results": False})
+    return formula_ids
+
+
+def test_reports_outlive_the_result_cache(monkeypatch):
+    monkeypatch.setattr(main.result_cache, "max_bytes", 1)
+    with TestClient(main.app) as client:
+        formula_ids = calculate_two_formulas(client)
+        response = client.get("/api/reports", params={"formula_id": formula_ids[0], "group_by": ""})
+        assert response.status_code == 200
+        report = response.json()
+        assert report["rollup_error"] is None
+        assert report["rollup"]["groups"][0]["rows"] == 50
+
+
+def test_reports_without_a_rollup_still_list_calculations(monkeypatch):
+    monkeypatch.setattr(main.result_cache, "max_bytes", 1)
+    monkeypatch.setattr(main.calculation_history, "max_bytes", 1)
+    with TestClient(main.app) as client:
+        formula_ids = calculate_two_formulas(client)
+        report = client.get("/api/reports", params={"formula_id": formula_ids[0]}).json()
+        assert report["rollup"] is None and "calculate it again" in report["rollup_error"]
+        assert formula_ids[0] in [calculation["formula_id"] for calculation in report["calculations"]]
+
+
+def test_evicted_rollups_are_rebuilt_or_reported_missing(store, write_rows):
+    dataset = write_rows(sales_frame(40))
+    results = {}
+    history = CalculationHistory(results.get, max_bytes=1)
+    compiled = compile_formula(FORMULA["formula_string"])
+    for i in range(2):
+        result = CalculationResult(dataset, str(i), FORMULA, compiled)
+        results[result.id] = result
+        history.record({"timestamp": f"2024-01-0{i + 1}T00:00:00", "calculation_id": result.id,
+                        "formula_id": str(i)}, result)
+    first, second = (entry["calculation_id"] for entry in history.entries)
+
+    # Only the newest rollup fits in the budget
+    assert list(history.rollups) == [second]
+    assert history.rollup(first).group([]) == Rollup.build(results[first]).group([])
+    del results[first], results[second]
+    assert history.rollup(first) is not None
+    assert history.rollup(second) is None
@@ -10,8 +10,23 @@ interface Formula {
   formula_string: string;
 }
 
+// Columnar results: one array of values per column
+type ResultColumns = Record<string, any[]>;
+
+const columnsToRows = (columns: ResultColumns, formulaUsed: string) => {
+  const names = Object.keys(columns);
+  const length = names.length ? columns[names[0]].length : 0;
+  return Array.from({ length }, (_, i) => {
+    const row: Record<string, any> = { 'Formula Used': formulaUsed };
+    names.forEach(name => { row[name] = columns[name][i]; });
+    return row;
+  });
+};
+
 interface CalculationResult {
-  results: any[];
+  calculation_id: string;
+  dataset_id: string;
+  version: number;
   summary: {
     total_processed: number;
     compliant_count: number;
@@ -24,8 +39,11 @@ interface CalculationResult {
 export default function CalculatePage() {
   const [formulas, setFormulas] = useState<Formula[]>([]);
   const [selectedFormula, setSelectedFormula] = useState<string>('');
-  const [uploadedData, setUploadedData] = useState<any[]>([]);
+  const [datasetId, setDatasetId] = useState<string>('');
+  const [uploadedRows, setUploadedRows] = useState(0);
   const [calculationResult, setCalculationResult] = useState<CalculationResult | null>(null);
+  // Distinct values for the filter dropdowns, by filter name
+  const [filterValues, setFilterValues] = useState<Record<string, string[]>>({});
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string>('');
   
@@ -37,6 +55,8 @@ export default function CalculatePage() {
     customer: ''
   });
   const [currentPage, setCurrentPage] = useState(1);
+  const [pageResults, setPageResults] = useState<any[]>([]);
+  const [totalResults, setTotalResults] = useState(0);
   const itemsPerPage = 20;
 
   useEffect(() => {
@@ -44,13 +64,43 @@ export default function CalculatePage() {
     setCurrentPage(1);
   }, [filters]);
 
+  useEffect(() => {
+    // Filtering and paging happen on the server
+    if (!calculationResult) return;
+
+    const fetchPage = async () => {
+      try {
+        const response = await axios.get(
+          `http://localhost:8000/api/calculations/${calculationResult.calculation_id}/results`,
+          {
+            params: {
+              product: filters.product || undefined,
+              date: filters.date ? filters.date.slice(0, 4) : undefined,
+              transaction_type: filters.transactionType || undefined,
+              customer: filters.customer || undefined,
+              offset: (currentPage - 1) * itemsPerPage,
+              limit: itemsPerPage,
+              layout: 'columns',
+            },
+          }
+        );
+        setPageResults(columnsToRows(response.data.columns, response.data.formula_used));
+        setTotalResults(response.data.total);
+      } catch (error: any) {
+        setError(error.response?.data?.detail || 'Error fetching results');
+      }
+    };
+
+    fetchPage();
+  }, [calculationResult, filters, currentPage]);
+
   useEffect(() => {
     // Fetch available formulas and uploaded data
     const fetchData = async () => {
       try {
         const [formulasResponse, dataResponse] = await Promise.all([
           axios.get('http://localhost:8000/api/formulas'),
-          axios.get('http://localhost:8000/api/data')
+          axios.get('http://localhost:8000/api/data', { params: { limit: 0 } })
         ]);
 
         setFormulas(Object.entries(formulasResponse.data).map(([id, formula]: [string, any]) => ({
@@ -58,7 +108,8 @@ export default function CalculatePage() {
           ...formula,
         })));
         
-        setUploadedData(dataResponse.data.data);
+        setDatasetId(dataResponse.data.dataset_id || '');
+        setUploadedRows(dataResponse.data.total || 0);
       } catch (error) {
         setError('Error fetching data');
       }
@@ -68,7 +119,7 @@ export default function CalculatePage() {
   }, []);
 
   const handleCalculate = async () => {
-    if (!selectedFormula || !uploadedData.length) {
+    if (!selectedFormula || !uploadedRows) {
       setError('Please select a formula and ensure data is uploaded');
       return;
     }
@@ -77,11 +128,21 @@ export default function CalculatePage() {
     setError('');
 
     try {
+      // Rows are fetched a page at a time, so leave them out of the calculation response
       const response = await axios.post('http://localhost:8000/api/calculate', {
         formula_id: selectedFormula,
-        data: uploadedData,
+        dataset_id: datasetId,
+        include_results: false,
+      });
+      const valuesResponse = await axios.get('http://localhost:8000/api/data/values', {
+        params: {
+          columns: 'product,transaction_type',
+          dataset_id: response.data.dataset_id,
+          version: response.data.version,
+        },
       });
 
+      setFilterValues(valuesResponse.data.values);
       setCalculationResult(response.data);
       setCurrentPage(1); // Reset to first page after new calculation
     } catch (error: any) {
@@ -91,34 +152,12 @@ export default function CalculatePage() {
     }
   };
 
-  // Filter the results
-  const getFilteredResults = () => {
-    if (!calculationResult) return [];
-    
-    return calculationResult.results.filter(row => {
-      return (
-        (!filters.product || row.Product.toLowerCase().includes(filters.product.toLowerCase())) &&
-        (!filters.date || row.Date?.includes(filters.date)) &&
-        (!filters.transactionType || row["Transaction Type"]?.toLowerCase().includes(filters.transactionType.toLowerCase())) &&
-        (!filters.customer || row.Customer?.toLowerCase().includes(filters.customer.toLowerCase()))
-      );
-    });
-  };
-
   // Get unique values for dropdowns
-  const getUniqueValues = (field: string) => {
-    if (!calculationResult) return [];
-    const values = new Set(calculationResult.results.map(row => row[field]));
-    return Array.from(values);
-  };
+  const getUniqueValues = (filter: string) => filterValues[filter] || [];
 
   // Calculate pagination
-  const filteredResults = getFilteredResults();
-  const totalPages = Math.ceil(filteredResults.length / itemsPerPage);
-  const currentResults = filteredResults.slice(
-    (currentPage - 1) * itemsPerPage,
-    currentPage * itemsPerPage
-  );
+  const totalPages = Math.ceil(totalResults / itemsPerPage);
+  const currentResults = pageResults;
 
   return (
     <div className="space-y-6">
@@ -157,7 +196,7 @@ export default function CalculatePage() {
           <div>
             <button
               onClick={handleCalculate}
-              disabled={loading || !selectedFormula || !uploadedData.length}
+              disabled={loading || !selectedFormula || !uploadedRows}
               className="inline-flex items-center px-4 py-2 border border-transparent text-sm font-medium rounded-md shadow-sm text-white bg-blue-500 hover:bg-blue-600 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-blue-500 disabled:bg-gray-300 disabled:cursor-not-allowed dark:disabled:bg-gray-600"
             >
               {loading ? 'Calculating...' : 'Calculate Prices'}
@@ -175,9 +214,17 @@ export default function CalculatePage() {
       {/* Results */}
       {calculationResult && (
         <div className="bg-white dark:bg-slate-800 shadow rounded-lg p-6">
-          <h3 className="text-lg font-medium text-gray-900 dark:text-white mb-4">
-            Calculation Results - {calculationResult.summary.formula_name}
-          </h3>
+          <div className="flex items-center justify-between mb-4">
+            <h3 className="text-lg font-medium text-gray-900 dark:text-white">
+              Calculation Results - {calculationResult.summary.formula_name}
+            </h3>
+            <a
+              href={`http://localhost:8000/api/calculations/${calculationResult.calculation_id}/export?format=csv`}
+              className="text-sm font-medium text-blue-500 hover:text-blue-600"
+            >
+              Export CSV
+            </a>
+          </div>
 
           {/* Summary */}
           <div className="grid grid-cols-1 md:grid-cols-3 gap-4 mb-6">
@@ -209,7 +256,7 @@ export default function CalculatePage() {
               onChange={(e) => setFilters({ ...filters, product: e.target.value })}
             >
               <option value="">Select Product</option>
-              {getUniqueValues('Product').map((product, index) => (
+              {getUniqueValues('product').map((product, index) => (
                 <option key={index} value={product}>{product}</option>
               ))}
             </select>
@@ -227,7 +274,7 @@ export default function CalculatePage() {
               onChange={(e) => setFilters({ ...filters, transactionType: e.target.value })}
             >
               <option value="">Transaction Type</option>
-              {getUniqueValues('Transaction Type').map((type, index) => (
+              {getUniqueValues('transaction_type').map((type, index) => (
                 <option key={index} value={type}>{type}</option>
               ))}
             </select>
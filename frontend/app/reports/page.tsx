@@ -4,6 +4,26 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 
+interface RollupGroup {
+  product?: string | null;
+  transaction_type?: string | null;
+  customer?: string | null;
+  date?: string | null;
+  rows: number;
+  total_sales: number;
+  calculated_price: number;
+  compliant_count: number;
+  non_compliant_count: number;
+  average_margin_to_limit: number | null;
+}
+
+const GROUP_BY_OPTIONS = [
+  { value: 'product', label: 'Product' },
+  { value: 'transaction_type', label: 'Sales Region' },
+  { value: 'customer', label: 'Customer' },
+  { value: 'date', label: 'Year' },
+] as const;
+
 interface Report {
   calculations: Array<{
     timestamp: string;
@@ -18,6 +38,12 @@ interface Report {
       rows_processed: number;
     } | null;
   };
+  rollup: {
+    calculation_id: string;
+    formula_name: string;
+    group_by: string[];
+    groups: RollupGroup[];
+  } | null;
 }
 
 export default function ReportsPage() {
@@ -28,16 +54,18 @@ export default function ReportsPage() {
     start: '',
     end: '',
   });
+  const [groupBy, setGroupBy] = useState<string>('product');
 
   useEffect(() => {
     fetchReports();
-  }, [dateRange]);
+  }, [dateRange, groupBy]);
 
   const fetchReports = async () => {
     try {
       const params = new URLSearchParams();
       if (dateRange.start) params.append('start_date', dateRange.start);
       if (dateRange.end) params.append('end_date', dateRange.end);
+      params.append('group_by', groupBy);
 
       const response = await axios.get(`http://localhost:8000/api/reports?${params.toString()}`);
       setReports(response.data);
@@ -129,6 +157,58 @@ export default function ReportsPage() {
         </div>
       </div>
 
+      {/* Compliance Rollup */}
+      <div className="bg-white shadow rounded-lg p-6">
+        <div className="flex items-center justify-between mb-4">
+          <h3 className="text-lg font-medium text-gray-900">
+            Compliance by Group{reports?.rollup ? ` (${reports.rollup.formula_name})` : ''}
+          </h3>
+          <select
+            value={groupBy}
+            onChange={(e) => setGroupBy(e.target.value)}
+            className="border border-gray-300 rounded-md py-1 px-2 text-sm"
+          >
+            {GROUP_BY_OPTIONS.map(option => (
+              <option key={option.value} value={option.value}>{option.label}</option>
+            ))}
+          </select>
+        </div>
+        {!reports?.rollup ? (
+          <p className="text-gray-500">No calculations found</p>
+        ) : (
+          <div className="overflow-x-auto">
+            <table className="min-w-full divide-y divide-gray-200">
+              <thead className="bg-gray-50">
+                <tr>
+                  {['Group', 'Rows', 'Total Sales', 'Calculated Price', 'Compliant', 'Non-Compliant', 'Avg. Margin to Limit'].map(header => (
+                    <th key={header} className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">
+                      {header}
+                    </th>
+                  ))}
+                </tr>
+              </thead>
+              <tbody className="bg-white divide-y divide-gray-200">
+                {reports.rollup.groups.map((group, index) => (
+                  <tr key={index}>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
+                      {group[groupBy as keyof RollupGroup] ?? '--'}
+                    </td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">{group.rows}</td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${group.total_sales.toFixed(2)}</td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${group.calculated_price.toFixed(2)}</td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-green-600">{group.compliant_count}</td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-red-600">{group.non_compliant_count}</td>
+                    <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
+                      {group.average_margin_to_limit === null ? '--' : `$${group.average_margin_to_limit.toFixed(2)}`}
+                    </td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        )}
+      </div>
+
       {/* Calculation History Table */}
       <div className="bg-white shadow rounded-lg p-6">
         <h3 className="text-lg font-medium text-gray-900 mb-4">Detailed History</h3>